@@ -4,19 +4,22 @@ from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocke
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from sqlalchemy import func as sqlalchemy_func
+from sqlalchemy import func as sqlalchemy_func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone, timedelta
 import time
 import os
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
-import json
 import asyncio
 import uuid
+import random
 import secrets
 
 # Local imports
-from database import SessionLocal, engine, Base, get_db
+from database import SessionLocal, engine, Base, get_db, apply_schema_upgrades
+from post_partitions import ensure_post_partitions
+from async_database import async_engine, get_async_db
 from crud import users, posts
 from schemas import (
     UserCreate, UserResponse, PostCreate, PostResponse, 
@@ -26,9 +29,10 @@ from pydantic import BaseModel, Field
 import redis.asyncio as redis
 from silhouet_config import PERSONALITY_KEYS
 from models import User
-from auth import create_access_token, verify_token
+from auth import create_access_token, verify_token, TTLCache
 
 from routes import messages
+from workers.message_queue import sentiment_channel_for_user
 
 load_dotenv()
 app = FastAPI()
@@ -46,49 +50,181 @@ app.add_middleware(
 )
 
 # --- WebSocket Connection Manager ---
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# What to do when a client's send queue is full: 'evict' closes the socket (the
+# client reconnects and reloads its scores), 'drop_oldest' discards the oldest
+# queued update to make room for the new one
+WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "evict")
+
+class ClientConnection:
+    """A socket with its bounded send queue, drained by its own sender task."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.closer: Optional[asyncio.Task] = None
+
 class ConnectionManager:
+    """
+    WebSockets held by this process, keyed by user id. The process subscribes
+    to a user's sentiment channel while it holds that user's socket, so with
+    several replicas or uvicorn workers each update is delivered only to the
+    process that can send it. Messages are queued per socket, so a slow client
+    only ever delays its own updates.
+    """
+
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.pubsub = None
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.clients_evicted = 0
+        self.send_errors = 0
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        previous = self.active_connections.get(client_id)
+        connection = ClientConnection(websocket)
+        connection.sender = asyncio.create_task(self._send_queued(client_id, connection))
+        self.active_connections[client_id] = connection
+        if previous is not None:
+            previous.sender.cancel()
+        elif self.pubsub is not None:
+            try:
+                await self.pubsub.subscribe(sentiment_channel_for_user(client_id))
+            except redis.RedisError as e:
+                # The listener resubscribes every held socket when it reconnects
+                print(f"Could not subscribe updates for {client_id}: {e}")
         print(f"WebSocket connected: {client_id}")
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            print(f"WebSocket disconnected: {client_id}")
+    async def disconnect(self, client_id: str, websocket: WebSocket = None):
+        connection = self.active_connections.get(client_id)
+        # A reconnect may already have replaced this socket; leave the new one alone
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return
+        del self.active_connections[client_id]
+        if connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+        if self.pubsub is not None:
+            try:
+                await self.pubsub.unsubscribe(sentiment_channel_for_user(client_id))
+            except redis.RedisError as e:
+                print(f"Could not unsubscribe updates for {client_id}: {e}")
+        print(f"WebSocket disconnected: {client_id}")
+
+    def send_message_to_client(self, client_id: str, message: str):
+        """Queues a message for the client without waiting for it to be sent."""
+        connection = self.active_connections.get(client_id)
+        if connection is None or connection.closer is not None:
+            return
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+        if WS_SLOW_CLIENT_POLICY == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+            self.messages_dropped += 1
+        else:
+            self.messages_dropped += 1 + connection.queue.qsize()
+            connection.closer = asyncio.create_task(
+                self._evict(client_id, connection, f"{connection.queue.qsize()} messages queued")
+            )
 
-    async def send_message_to_client(self, client_id: str, message: str):
-        websocket = self.active_connections.get(client_id)
-        if websocket:
+    async def _send_queued(self, client_id: str, connection: ClientConnection):
+        while True:
+            message = await connection.queue.get()
             try:
-                await websocket.send_text(message)
-            except RuntimeError as e:
+                await asyncio.wait_for(connection.websocket.send_text(message), WS_SEND_TIMEOUT_SECONDS)
+                self.messages_sent += 1
+            except asyncio.TimeoutError:
+                self.messages_dropped += 1 + connection.queue.qsize()
+                await self._evict(client_id, connection, f"send took over {WS_SEND_TIMEOUT_SECONDS}s")
+                return
+            except Exception as e:
+                self.send_errors += 1
                 print(f"Failed to send to client {client_id}: {e}. Disconnecting.")
-                self.disconnect(client_id)
+                await self.disconnect(client_id, connection.websocket)
+                return
+
+    async def _evict(self, client_id: str, connection: ClientConnection, reason: str):
+        self.clients_evicted += 1
+        print(f"Evicting slow WebSocket client {client_id}: {reason}.")
+        await self.disconnect(client_id, connection.websocket)
+        try:
+            # 1013: try again later
+            await asyncio.wait_for(connection.websocket.close(code=1013), WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": WS_SEND_QUEUE_SIZE,
+            "slow_client_policy": WS_SLOW_CLIENT_POLICY,
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "clients_evicted": self.clients_evicted,
+            "send_errors": self.send_errors,
+        }
 
 manager = ConnectionManager()
 redis_client: redis.Redis = None
-PUBSUB_CHANNEL = "sentiment_updates"
 
 # --- Redis Pub/Sub Listener ---
+REDIS_LISTENER_RETRY_BASE_SECONDS = float(os.getenv("REDIS_LISTENER_RETRY_BASE_SECONDS", "0.5"))
+REDIS_LISTENER_RETRY_MAX_SECONDS = float(os.getenv("REDIS_LISTENER_RETRY_MAX_SECONDS", "30"))
+# Private to this process; keeping it subscribed lets listen() block while no sockets are connected
+LISTENER_CHANNEL = f"listener:{uuid.uuid4().hex}"
+
+async def open_pubsub():
+    """New Pub/Sub connection subscribed to the channel of every socket this process holds."""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(LISTENER_CHANNEL)
+    # Sockets connecting from here on subscribe themselves
+    manager.pubsub = pubsub
+    channels = [sentiment_channel_for_user(client_id) for client_id in list(manager.active_connections)]
+    if channels:
+        await pubsub.subscribe(*channels)
+    return pubsub
+
 async def listen_for_redis_updates():
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(PUBSUB_CHANNEL)
+    failures = 0
     while True:
+        pubsub = None
         try:
-            message = await pubsub.get_message(ignore_subscribe_messages=True)
-            if message and message.get('data'):
-                decoded_message = json.loads(message['data'])
-                user_id = decoded_message.get("user_id")
-                if user_id:
-                    await manager.send_message_to_client(user_id, json.dumps(decoded_message))
-            await asyncio.sleep(0.01)
+            pubsub = await open_pubsub()
+            if failures:
+                print("Redis listener reconnected.")
+            failures = 0
+            async for message in pubsub.listen():
+                if message['type'] != 'message' or message['channel'] == LISTENER_CHANNEL:
+                    continue
+                # The channel names the user, so the payload is forwarded without parsing it
+                client_id = message['channel'].split(":", 1)[1]
+                manager.send_message_to_client(client_id, message['data'])
+            raise redis.ConnectionError("Pub/Sub connection stopped listening")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Error in Redis listener: {e}")
-            await asyncio.sleep(5)
+            failures += 1
+            # Exponential backoff with jitter, so replicas do not reconnect in lockstep
+            ceiling = min(REDIS_LISTENER_RETRY_MAX_SECONDS, REDIS_LISTENER_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+            delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+            print(f"Error in Redis listener: {e}. Reconnecting in {delay:.1f}s.")
+            manager.pubsub = None
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
 
 # --- Application Lifecycle Events ---
 @app.on_event("startup")
@@ -98,6 +234,9 @@ async def on_startup():
         try:
             db = SessionLocal()
             Base.metadata.create_all(bind=engine)
+            apply_schema_upgrades()
+            if not ensure_post_partitions():
+                print("WARNING: posts is not partitioned. Run 'python post_partitions.py convert'.")
             db.close()
             print("Database tables ensured.")
             break
@@ -120,33 +259,46 @@ async def on_shutdown():
     if redis_client:
         await redis_client.close()
         print("Redis client closed.")
+    await async_engine.dispose()
 
 # --- Dependencies ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Authenticated identities by token `sub`, so hot paths usually skip the users
+# query. Only fields that never change are cached (user_id, public_key,
+# created_at); scores are always read fresh.
+principal_cache = TTLCache(
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "10")),
+    max_entries=int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000")),
+)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     token_data = verify_token(token, credentials_exception)
-    user = users.get_user_by_public_key(db, public_key=token_data.sub)
-    if user is None:
-        raise credentials_exception
-    return user
+    principal = principal_cache.get(token_data.sub)
+    if principal is None:
+        user = await users.get_user_by_public_key_async(db, public_key=token_data.sub)
+        if user is None:
+            raise credentials_exception
+        principal = UserResponse.model_validate(user)
+        principal_cache.set(token_data.sub, principal)
+    return principal
 
 # --- API Endpoints ---
 
 # Authentication
 @app.post("/auth/challenge", response_model=ChallengeResponse)
-async def get_challenge(request: ChallengeRequest, db: Session = Depends(get_db)):
-    if not users.get_user_by_public_key(db, public_key=request.public_key):
+async def get_challenge(request: ChallengeRequest, db: AsyncSession = Depends(get_async_db)):
+    if not await users.get_user_by_public_key_async(db, public_key=request.public_key):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     challenge = secrets.token_hex(32)
     await redis_client.set(f"challenge:{request.public_key}", challenge, ex=300)
     return ChallengeResponse(challenge=challenge)
 
 @app.post("/users/login", response_model=Token)
-async def login_for_access_token(user_login: UserLogin, db: Session = Depends(get_db)):
+async def login_for_access_token(user_login: UserLogin, db: AsyncSession = Depends(get_async_db)):
     db_user = await users.authenticate_user_challenge(
         db, redis_client, user_login.public_key, user_login.signature
     )
@@ -169,23 +321,25 @@ def create_new_user(user: UserCreate, db: Session = Depends(get_db)):
     return created_user
 
 @app.get("/users/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: UserResponse = Depends(get_current_user)):
     return current_user
 
 # Posts
 @app.post("/posts/", response_model=PostResponse, status_code=status.HTTP_201_CREATED)
-def create_new_post(post: PostCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_new_post(post: PostCreate, db: AsyncSession = Depends(get_async_db), current_user: UserResponse = Depends(get_current_user)):
     # The user_id from the post body is ignored; the authenticated user is used instead.
-    return posts.create_post(db=db, post_text=post.raw_text, user_id=current_user.user_id)
+    return await posts.create_post_async(db=db, post_text=post.raw_text, user_id=current_user.user_id)
 
 @app.get("/users/me/posts", response_model=list[PostResponse])
-def read_my_posts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return posts.get_posts_by_user(db, user_id=current_user.user_id, skip=skip, limit=limit)
+async def read_my_posts(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), current_user: UserResponse = Depends(get_current_user)):
+    return await posts.get_posts_by_user_async(db, user_id=current_user.user_id, skip=skip, limit=limit)
 
 # Scores
 @app.get("/scores/me", status_code=status.HTTP_200_OK)
-def get_my_scores(current_user: User = Depends(get_current_user)):
-    scores = {f"avg_{key}_score": getattr(current_user, f"avg_{key}_score", 0.5) for key in PERSONALITY_KEYS}
+async def get_my_scores(db: AsyncSession = Depends(get_async_db), current_user: UserResponse = Depends(get_current_user)):
+    scores = await users.get_user_scores_async(db, user_id=current_user.user_id)
+    if scores is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
     return scores
 
 class FilteredScoresRequest(BaseModel):
@@ -194,16 +348,21 @@ class FilteredScoresRequest(BaseModel):
     # ... other filters
     
 @app.post("/scores/filtered", status_code=status.HTTP_200_OK)
-def get_filtered_scores(filters: FilteredScoresRequest, db: Session = Depends(get_db)):
-    query = db.query(User)
+async def get_filtered_scores(filters: FilteredScoresRequest, db: AsyncSession = Depends(get_async_db)):
+    avg_scores = {f"avg_{key}_score": sqlalchemy_func.avg(getattr(User, f"avg_{key}_score")) for key in PERSONALITY_KEYS}
+    # One round trip: the user count and every average together
+    query = select(sqlalchemy_func.count(User.user_id), *avg_scores.values())
     # Apply filters...
-    if query.count() == 0:
+    user_count, *result = (await db.execute(query)).one()
+    if user_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No users match criteria.")
-    avg_scores = {f"avg_{key}_score": sqlalchemy_func.avg(getattr(User, f"avg_{key}_score")) for key in PERSONALITY_KEYS}
-    result = query.with_entities(*avg_scores.values()).one()
     return {key: round(value, 4) if value is not None else 0.5 for key, value in zip(avg_scores.keys(), result)}
 
 # WebSocket
+@app.get("/ws/stats")
+async def websocket_stats():
+    return manager.stats()
+
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket, client_id)
@@ -211,7 +370,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         while True:
             await websocket.receive_text() # Keep connection alive
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        await manager.disconnect(client_id, websocket)
     except Exception as e:
         print(f"WebSocket error for {client_id}: {e}")
-        manager.disconnect(client_id)
+        await manager.disconnect(client_id, websocket)
@@ -0,0 +1,32 @@
+# backend/async_database.py
+import os
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import DATABASE_URL
+
+# Same database as database.py, through asyncpg, for the request handlers that
+# run on the event loop. Kept out of database.py so the Celery worker and the
+# maintenance scripts do not need asyncpg installed.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+)
+
+# expire_on_commit=False: attributes stay readable after commit without an
+# implicit (and, under asyncio, disallowed) lazy reload
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+async def get_async_db():
+    """Dependency to get an async database session for FastAPI endpoints."""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,6 +1,10 @@
 # backend/auth.py
 import os
 import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 from jose import JWTError, jwt
@@ -14,15 +18,86 @@ KEYS_FILE = '/keys/rotating_keys.json'
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
-def get_keys() -> List[str]:
-    """Reads the list of valid keys from the keys file."""
-    try:
-        with open(KEYS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If the file doesn't exist or is empty/corrupt, we cannot proceed.
-        # The entrypoint script should prevent this, but this is a safeguard.
-        raise RuntimeError("Could not load secret keys. The key file is missing or invalid.")
+# The key ring is cached in process. The file is stat()ed at most every
+# KEY_RING_CHECK_SECONDS and only re-read when it was replaced or modified, so
+# verifying a token normally does no file I/O.
+KEY_RING_CHECK_SECONDS = float(os.getenv("KEY_RING_CHECK_SECONDS", "1"))
+_key_ring = {"keys": None, "by_kid": {}, "signature": None, "checked_at": 0.0}
+_key_ring_lock = threading.Lock()
+
+# Tokens signed before key ids were introduced carry no `kid` and are checked
+# against every key. They expire within ACCESS_TOKEN_EXPIRE_MINUTES, after which
+# this can be switched off.
+ACCEPT_KEYLESS_TOKENS = os.getenv("JWT_ACCEPT_KEYLESS_TOKENS", "true").lower() == "true"
+
+def key_id(key: str) -> str:
+    """Stable, non-secret id of a signing key, sent as the token's `kid` header."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def _read_keys_file() -> List[str]:
+    with open(KEYS_FILE, 'r') as f:
+        return json.load(f)
+
+def get_keys(force: bool = False) -> List[str]:
+    """
+    Returns the list of valid keys, newest first, reloading the keys file when it
+    changes. `force` checks the file now instead of waiting for KEY_RING_CHECK_SECONDS.
+    """
+    now = time.monotonic()
+    if not force and _key_ring["keys"] is not None and now - _key_ring["checked_at"] < KEY_RING_CHECK_SECONDS:
+        return _key_ring["keys"]
+
+    with _key_ring_lock:
+        try:
+            stat = os.stat(KEYS_FILE)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature != _key_ring["signature"] or _key_ring["keys"] is None:
+                keys = _read_keys_file()
+                _key_ring["by_kid"] = {key_id(key): key for key in keys}
+                _key_ring["keys"] = keys
+                _key_ring["signature"] = signature
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Keep serving the last good key ring if the file is briefly unreadable
+            if _key_ring["keys"] is None:
+                # If the file doesn't exist or is empty/corrupt, we cannot proceed.
+                # The entrypoint script should prevent this, but this is a safeguard.
+                raise RuntimeError("Could not load secret keys. The key file is missing or invalid.")
+        _key_ring["checked_at"] = now
+        return _key_ring["keys"]
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
 
 class TokenData(BaseModel):
     sub: Optional[str] = None
@@ -41,30 +116,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         raise RuntimeError("No secret keys available for signing.")
     signing_key = keys[0]
     
-    encoded_jwt = jwt.encode(to_encode, signing_key, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, signing_key, algorithm=ALGORITHM, headers={"kid": key_id(signing_key)})
     return encoded_jwt
 
+def _decode_sub(token: str, key: str) -> Optional[str]:
+    try:
+        return jwt.decode(token, key, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 def verify_token(token: str, credentials_exception):
     # Get all valid keys for verification
     valid_keys = get_keys()
     if not valid_keys:
         raise credentials_exception
 
-    last_exception = None
-    for key in valid_keys:
-        try:
-            payload = jwt.decode(token, key, algorithms=[ALGORITHM])
-            public_key: str = payload.get("sub")
-            if public_key is None:
-                # This case should ideally not be hit if the token was signed correctly
-                continue 
-            return TokenData(sub=public_key)
-        except JWTError as e:
-            # Store the exception but continue to try other keys
-            last_exception = e
-            continue
-    
-    # If the loop completes without returning, it means no key worked.
-    # We raise the original credentials_exception for consistency,
-    # but you could also raise the last_exception for more specific debugging.
-    raise credentials_exception
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except JWTError:
+        raise credentials_exception
+
+    if kid is not None:
+        # One lookup and one signature check
+        key = _key_ring["by_kid"].get(kid)
+        if key is None:
+            # Another process may already sign with a key rotated in since this
+            # ring was checked. The forced check is a stat(); the file is only
+            # re-read if it changed, so unknown kids stay cheap to reject.
+            get_keys(force=True)
+            key = _key_ring["by_kid"].get(kid)
+        public_key = _decode_sub(token, key) if key else None
+    elif ACCEPT_KEYLESS_TOKENS:
+        public_key = next(filter(None, (_decode_sub(token, key) for key in valid_keys)), None)
+    else:
+        public_key = None
+
+    if public_key is None:
+        raise credentials_exception
+    return TokenData(sub=public_key)
@@ -0,0 +1,131 @@
+# backend/bench/bench_ws_fanout.py
+"""
+Measures WebSocket fan-out of sentiment updates through a running backend.
+
+Opens --connections sockets on /ws/{user_id} with random user ids, publishes
+updates straight to the per-user Redis channels at --rate messages/second, and
+reports connections held, delivered messages/second, delivery ratio and
+publish-to-receive latency. Start the backend with the worker count under test,
+then run the benchmark once per setting:
+
+    uvicorn app:app --port 8000 --workers 4
+    python bench/bench_ws_fanout.py --label workers=4 [--connections 2000] [--rate 1000] [--duration 30]
+
+Every update is sent to exactly one process, the one holding the socket, so
+delivered messages/second should scale with workers until Redis or the network
+is the limit.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+import redis.asyncio as redis
+import websockets
+
+CHANNEL_PREFIX = "sentiment_updates"
+
+async def open_connections(url, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    connections = {}
+
+    async def connect(user_id):
+        async with semaphore:
+            try:
+                connections[user_id] = await websockets.connect(f"{url}/ws/{user_id}", max_queue=None)
+            except (OSError, websockets.WebSocketException) as e:
+                print(f"Connection failed for {user_id}: {e}")
+
+    await asyncio.gather(*(connect(str(uuid.uuid4())) for _ in range(count)))
+    return connections
+
+async def receive(ws, latencies, stop_at):
+    while time.time() < stop_at:
+        try:
+            raw = await asyncio.wait_for(ws.recv(), timeout=max(stop_at - time.time(), 0.01))
+        except (asyncio.TimeoutError, websockets.ConnectionClosed):
+            return
+        latencies.append(time.time() - json.loads(raw)["sent"])
+
+async def publish(redis_client, user_ids, rate, duration):
+    published = 0
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        # Publish in small pipelined bursts to hold the target rate
+        due = int((time.monotonic() - started) * rate) - published
+        if due > 0:
+            pipe = redis_client.pipeline(transaction=False)
+            for _ in range(due):
+                user_id = random.choice(user_ids)
+                pipe.publish(f"{CHANNEL_PREFIX}:{user_id}", json.dumps({"type": "bench", "seq": published, "sent": time.time()}))
+                published += 1
+            await pipe.execute()
+        await asyncio.sleep(0.005)
+    return published
+
+async def run(args):
+    redis_client = redis.from_url(args.redis)
+    started = time.monotonic()
+    connections = await open_connections(args.url, args.connections, args.connect_concurrency)
+    connect_seconds = time.monotonic() - started
+    if not connections:
+        raise SystemExit("No WebSocket connections could be opened.")
+    await asyncio.sleep(args.settle)
+
+    subscribed = len(await redis_client.pubsub_channels(f"{CHANNEL_PREFIX}:*"))
+    latencies = []
+    stop_at = time.time() + args.duration + args.drain
+    receivers = [asyncio.create_task(receive(ws, latencies, stop_at)) for ws in connections.values()]
+    published = await publish(redis_client, list(connections), args.rate, args.duration)
+    await asyncio.gather(*receivers)
+
+    for ws in connections.values():
+        await ws.close()
+    await redis_client.close()
+
+    delivered = len(latencies)
+    latencies.sort()
+    pct = lambda p: latencies[min(int(p * delivered), delivered - 1)] * 1000 if delivered else float("nan")
+    return {
+        "label": args.label,
+        "connections": len(connections),
+        "connect_seconds": round(connect_seconds, 2),
+        "subscribed_channels": subscribed,
+        "published": published,
+        "delivered": delivered,
+        "delivery_ratio": round(delivered / published, 4) if published else 0.0,
+        "delivered_per_sec": round(delivered / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p95_ms": round(pct(0.95), 2) if latencies else None,
+        "p99_ms": round(pct(0.99), 2) if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket fan-out of sentiment updates")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--redis", default="redis://127.0.0.1:6379/0")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=500, help="Published messages per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to publish for")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait for subscriptions after connecting")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to keep receiving after publishing stops")
+    parser.add_argument("--label", default="", help="Free-form tag for the run, e.g. workers=4")
+    parser.add_argument("--json", help="Append the result as one JSON line to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(f"{'label':<12} {'conns':>6} {'subs':>6} {'sent':>8} {'recv':>8} {'ratio':>7} {'recv/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    fmt = lambda v: f"{v:.1f}" if v is not None else "n/a"
+    print(f"{result['label']:<12} {result['connections']:>6} {result['subscribed_channels']:>6} {result['published']:>8} "
+          f"{result['delivered']:>8} {result['delivery_ratio']:>7.2%} {result['delivered_per_sec']:>8.1f} "
+          f"{fmt(result['p50_ms']):>8} {fmt(result['p95_ms']):>8} {fmt(result['p99_ms']):>8}")
+    if args.json:
+        with open(args.json, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
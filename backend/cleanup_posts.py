@@ -0,0 +1,74 @@
+# backend/cleanup_posts.py
+"""
+Retention for a posts table that is not partitioned: deletes posts older than
+POSTS_RETENTION_DAYS in small batches, oldest first, pausing between batches
+and stopping when the time budget is used up, so cleanup never holds long
+locks or floods WAL while users are posting. Every batch commits on its own;
+whatever is left is picked up by the next run. Run from cron:
+
+    python cleanup_posts.py [--batch-size 2000] [--sleep 0.2] [--time-budget 900]
+
+Partitioned tables are skipped; post_partitions.py drops their expired partitions.
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from database import engine
+from post_partitions import POSTS_RETENTION_DAYS, is_partitioned
+
+def delete_batch(conn, cutoff: datetime, batch_size: int) -> int:
+    return conn.execute(
+        text("""
+            DELETE FROM posts
+            WHERE id IN (
+                SELECT id FROM posts
+                WHERE created_at < :cutoff
+                ORDER BY created_at
+                LIMIT :batch_size
+            )
+        """),
+        {"cutoff": cutoff, "batch_size": batch_size},
+    ).rowcount
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Delete expired posts in throttled batches")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Posts deleted per transaction")
+    parser.add_argument("--sleep", type=float, default=0.2, help="Seconds to pause between batches")
+    parser.add_argument("--time-budget", type=float, default=900, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        if is_partitioned(conn):
+            logging.info("posts is partitioned; expired partitions are dropped by post_partitions.py. Nothing to do.")
+            return
+
+    # Fixed for the whole run, so a run always ends even if posts keep expiring
+    cutoff = datetime.now(timezone.utc) - timedelta(days=POSTS_RETENTION_DAYS)
+    started = time.monotonic()
+    deadline = started + args.time_budget
+    deleted = 0
+    finished = False
+    while time.monotonic() < deadline:
+        with engine.begin() as conn:
+            count = delete_batch(conn, cutoff, args.batch_size)
+        deleted += count
+        if count < args.batch_size:
+            finished = True
+            break
+        time.sleep(args.sleep)
+
+    elapsed = time.monotonic() - started
+    rate = deleted / elapsed if elapsed > 0 else 0.0
+    if finished:
+        logging.info(f"Deleted {deleted} posts older than {cutoff:%Y-%m-%d %H:%M} in {elapsed:.0f}s ({rate:.0f} rows/s).")
+    else:
+        logging.info(f"Time budget used up after deleting {deleted} posts ({rate:.0f} rows/s). "
+                     "The next run continues with the remaining expired posts.")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # backend/crud/posts.py
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 import uuid
 # Removed httpx import - no longer needed for direct call
 # Removed MODEL_SERVICE_URL constant - task handles it
@@ -8,20 +10,20 @@ from models import Post
 from schemas import PostCreate
 
 # Import the Celery task
-from workers.celery_worker import process_post_sentiment_task # <<< NEW IMPORT
+from workers.celery_worker import enqueue_post_sentiment
 
-def create_post(db: Session, post_text: str, user_id: uuid.UUID):
-    # 1. Create the post entry in the database
+async def create_post_async(db: AsyncSession, post_text: str, user_id: uuid.UUID):
     db_post = Post(user_id=user_id, raw_text=post_text)
     db.add(db_post)
-    db.commit()
-    db.refresh(db_post)
+    await db.commit()
+    await db.refresh(db_post)
 
-    # 2. Enqueue the sentiment analysis task
-    process_post_sentiment_task.delay(str(db_post.id), db_post.raw_text)
+    # The enqueue talks to Redis with a blocking client; keep it off the event loop
+    await run_in_threadpool(enqueue_post_sentiment, str(db_post.id), str(user_id), db_post.raw_text)
     print(f"Post {db_post.id}: Sentiment analysis task enqueued for user {user_id}.")
 
     return db_post
 
-def get_posts_by_user(db: Session, user_id: uuid.UUID, skip: int = 0, limit: int = 100):
-    return db.query(Post).filter(Post.user_id == user_id).offset(skip).limit(limit).all()
+async def get_posts_by_user_async(db: AsyncSession, user_id: uuid.UUID, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(Post).where(Post.user_id == user_id).offset(skip).limit(limit))
+    return result.scalars().all()
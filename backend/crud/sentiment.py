@@ -0,0 +1,228 @@
+# backend/crud/sentiment.py
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from silhouet_config import PERSONALITY_KEYS
+
+def scores_array_literal(scores: dict) -> str:
+    """Postgres array literal of a {key: score} dict in PERSONALITY_KEYS order; missing keys are NULL."""
+    return "{" + ",".join(repr(float(scores[key])) if scores.get(key) is not None else "NULL" for key in PERSONALITY_KEYS) + "}"
+
+def bulk_update_post_scores(db: Session, scores_by_post: Dict[str, dict]) -> List[Tuple[uuid.UUID, uuid.UUID]]:
+    """
+    Writes sentiment scores for many posts with a single UPDATE ... FROM unnest(...)
+    statement and stamps their scored_at. Does not commit: the caller folds the
+    returned posts into user averages in the same transaction, so scored_at is
+    the ledger of counted posts. Posts that already have scored_at are left
+    alone, so a redelivered task cannot count a post twice. Returns
+    (post_id, user_id) for every post scored by this call.
+    """
+    if not scores_by_post:
+        return []
+    post_ids = list(scores_by_post.keys())
+    # Each row travels as a text array literal: unnest() would flatten a real[][]
+    scores = [scores_array_literal(scores_by_post[post_id]) for post_id in post_ids]
+    result = db.execute(
+        text("""
+            UPDATE posts AS p
+            SET sentiment_scores = CAST(v.scores AS real[]),
+                scored_at = NOW(),
+                updated_at = NOW()
+            FROM unnest(CAST(:post_ids AS uuid[]), CAST(:scores AS text[])) AS v(id, scores)
+            WHERE p.id = v.id AND p.scored_at IS NULL
+            RETURNING p.id, p.user_id
+        """),
+        {"post_ids": post_ids, "scores": scores},
+    )
+    return [(row.id, row.user_id) for row in result]
+
+def find_unscored_posts(db: Session, older_than_seconds: int, max_age_hours: int, limit: int) -> List[Tuple[uuid.UUID, uuid.UUID, str]]:
+    """
+    Posts still unscored `older_than_seconds` after creation (but created within
+    the last `max_age_hours`), oldest first, as (post_id, user_id, raw_text).
+    """
+    result = db.execute(
+        text("""
+            SELECT id, user_id, raw_text
+            FROM posts
+            WHERE scored_at IS NULL
+              AND created_at < NOW() - make_interval(secs => :older_than)
+              AND created_at > NOW() - make_interval(hours => :max_age)
+            ORDER BY created_at
+            LIMIT :limit
+        """),
+        {"older_than": older_than_seconds, "max_age": max_age_hours, "limit": limit},
+    )
+    return [(row.id, row.user_id, row.raw_text) for row in result]
+
+def fetch_scored_posts_after(db: Session, after_post_id: Optional[uuid.UUID], limit: int) -> List[Tuple[uuid.UUID, str]]:
+    """
+    Keyset page of already-scored posts ordered by id, as (post_id, raw_text).
+    Pass the last id of the previous page to continue; cost does not grow with
+    how far into the table the page is.
+    """
+    result = db.execute(
+        text("""
+            SELECT id, raw_text
+            FROM posts
+            WHERE scored_at IS NOT NULL
+              AND (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid))
+            ORDER BY id
+            LIMIT :limit
+        """),
+        {"after": str(after_post_id) if after_post_id else None, "limit": limit},
+    )
+    return [(row.id, row.raw_text) for row in result]
+
+def overwrite_post_scores(db: Session, scores_by_post: Dict[str, dict]) -> Tuple[int, int]:
+    """
+    Replaces the stored scores of already-scored posts and moves each owner's
+    running averages by the difference, in one statement:
+
+        avg_x = avg_x + sum(new_x - old_x) / total_posts_count
+
+    total_posts_count is left alone, so averages keep the contribution of posts
+    already removed by retention. Posts with no previous array (legacy JSON not
+    yet migrated) are rescored but cannot be folded. Users are locked in
+    user_id order, like the live pipeline. Does not commit. Returns
+    (posts updated, posts rescored without a previous array).
+    """
+    if not scores_by_post:
+        return 0, 0
+    post_ids = list(scores_by_post.keys())
+    scores = [scores_array_literal(scores_by_post[post_id]) for post_id in post_ids]
+    deltas = ", ".join(
+        f"SUM(v.scores[{i + 1}] - o.old_scores[{i + 1}]) AS delta_{key}" for i, key in enumerate(PERSONALITY_KEYS)
+    )
+    setters = ", ".join(
+        f"avg_{key}_score = u.avg_{key}_score + COALESCE(d.delta_{key} / u.total_posts_count, 0)" for key in PERSONALITY_KEYS
+    )
+    row = db.execute(
+        text(f"""
+            WITH v AS (
+                SELECT id, CAST(scores AS real[]) AS scores
+                FROM unnest(CAST(:post_ids AS uuid[]), CAST(:scores AS text[])) AS v(id, scores)
+            ),
+            o AS (
+                SELECT p.id, p.user_id, p.sentiment_scores AS old_scores
+                FROM posts p JOIN v ON v.id = p.id
+                WHERE p.scored_at IS NOT NULL
+                FOR UPDATE OF p
+            ),
+            updated AS (
+                UPDATE posts AS p
+                SET sentiment_scores = v.scores,
+                    sentiment_scores_json = NULL,
+                    updated_at = NOW()
+                FROM v
+                WHERE p.id = v.id AND p.scored_at IS NOT NULL
+                RETURNING p.id
+            ),
+            locked AS (
+                SELECT user_id FROM users
+                WHERE user_id IN (SELECT user_id FROM o)
+                ORDER BY user_id
+                FOR UPDATE
+            ),
+            d AS (
+                SELECT o.user_id, {deltas}
+                FROM o JOIN v ON v.id = o.id
+                WHERE o.old_scores IS NOT NULL AND o.user_id IN (SELECT user_id FROM locked)
+                GROUP BY o.user_id
+            ),
+            folded AS (
+                UPDATE users AS u
+                SET {setters},
+                    updated_at = NOW()
+                FROM d
+                WHERE u.user_id = d.user_id AND u.total_posts_count > 0
+            )
+            SELECT (SELECT COUNT(*) FROM updated) AS posts_updated,
+                   (SELECT COUNT(*) FROM o WHERE old_scores IS NULL) AS without_previous
+        """),
+        {"post_ids": post_ids, "scores": scores},
+    ).one()
+    return row.posts_updated, row.without_previous
+
+def recompute_user_averages(db: Session, after_user_id: Optional[uuid.UUID], limit: int) -> Tuple[int, Optional[uuid.UUID]]:
+    """
+    Resets avg_*_score and total_posts_count to the average and count of the
+    posts still in the table for the next `limit` users (by user_id after
+    `after_user_id`), in one set-based UPDATE. Destructive: posts already
+    removed by retention stop counting, so all-time averages become averages
+    over the retention window. Users without scored posts keep their values.
+    Does not commit. Returns (users in the page, last user_id of the page),
+    with None as the last id once every user has been visited.
+    """
+    user_ids = [row.user_id for row in db.execute(
+        text("""
+            SELECT user_id FROM users
+            WHERE CAST(:after AS uuid) IS NULL OR user_id > CAST(:after AS uuid)
+            ORDER BY user_id
+            LIMIT :limit
+        """),
+        {"after": str(after_user_id) if after_user_id else None, "limit": limit},
+    )]
+    if not user_ids:
+        return 0, None
+
+    averages = ", ".join(
+        f"AVG(p.sentiment_scores[{i + 1}]) AS avg_{key}_score" for i, key in enumerate(PERSONALITY_KEYS)
+    )
+    setters = ", ".join(
+        f"avg_{key}_score = COALESCE(s.avg_{key}_score, u.avg_{key}_score)" for key in PERSONALITY_KEYS
+    )
+    db.execute(
+        text(f"""
+            UPDATE users AS u
+            SET {setters},
+                total_posts_count = s.post_count,
+                updated_at = NOW()
+            FROM (
+                SELECT p.user_id, COUNT(*) AS post_count, {averages}
+                FROM posts p
+                WHERE p.scored_at IS NOT NULL AND p.sentiment_scores IS NOT NULL AND p.user_id = ANY(CAST(:user_ids AS uuid[]))
+                GROUP BY p.user_id
+            ) AS s
+            WHERE u.user_id = s.user_id
+        """),
+        {"user_ids": [str(user_id) for user_id in user_ids]},
+    )
+    return len(user_ids), user_ids[-1]
+
+def migrate_json_scores_after(db: Session, after_post_id: Optional[uuid.UUID], limit: int) -> Optional[uuid.UUID]:
+    """
+    Copies the next `limit` posts' legacy sentiment_scores_json into
+    sentiment_scores and clears the JSON. Handles both JSON objects and the JSON
+    strings holding an object that older workers wrote. Posts that already
+    have an array keep it. Does not commit. Returns the last post id migrated,
+    or None when no legacy rows remain after `after_post_id`.
+    """
+    elements = ", ".join(f"CAST(b.obj->>'{key}' AS REAL)" for key in PERSONALITY_KEYS)
+    result = db.execute(
+        text(f"""
+            WITH batch AS (
+                SELECT id,
+                       CASE WHEN jsonb_typeof(sentiment_scores_json) = 'string'
+                            THEN CAST(sentiment_scores_json #>> '{{}}' AS jsonb)
+                            ELSE sentiment_scores_json
+                       END AS obj
+                FROM posts
+                WHERE sentiment_scores_json IS NOT NULL
+                  AND (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid))
+                ORDER BY id
+                LIMIT :limit
+            )
+            UPDATE posts AS p
+            SET sentiment_scores = COALESCE(p.sentiment_scores, ARRAY[{elements}]),
+                sentiment_scores_json = NULL
+            FROM batch AS b
+            WHERE p.id = b.id
+            RETURNING p.id
+        """),
+        {"after": str(after_post_id) if after_post_id else None, "limit": limit},
+    )
+    post_ids = [row.id for row in result]
+    return max(post_ids) if post_ids else None
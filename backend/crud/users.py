@@ -1,9 +1,12 @@
 # backend/crud/users.py
+from sqlalchemy import Float, cast, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models import User
 from schemas import UserCreate, UserCreateResponse
 import uuid
 from datetime import datetime, timezone
+from typing import Optional
 from silhouet_config import PERSONALITY_KEYS
 from sqlalchemy.exc import IntegrityError
 from nacl.signing import VerifyKey
@@ -14,6 +17,18 @@ import redis.asyncio as redis
 def get_user_by_public_key(db: Session, public_key: str):
     return db.query(User).filter(User.public_key == public_key).first()
 
+async def get_user_by_public_key_async(db: AsyncSession, public_key: str):
+    result = await db.execute(select(User).where(User.public_key == public_key))
+    return result.scalars().first()
+
+async def get_user_scores_async(db: AsyncSession, user_id: uuid.UUID) -> Optional[dict]:
+    """The user's current avg_*_score values, or None if the user does not exist."""
+    columns = [getattr(User, f"avg_{key}_score") for key in PERSONALITY_KEYS]
+    row = (await db.execute(select(*columns).where(User.user_id == user_id))).first()
+    if row is None:
+        return None
+    return {f"avg_{key}_score": value for key, value in zip(PERSONALITY_KEYS, row)}
+
 def create_user(db: Session, user_data: UserCreate) -> UserCreateResponse:
     """
     Creates a new user record in the database with a client-provided public key.
@@ -49,12 +64,12 @@ def create_user(db: Session, user_data: UserCreate) -> UserCreateResponse:
         db.rollback()
         raise e
 
-async def authenticate_user_challenge(db: Session, redis_client: redis.Redis, public_key: str, signature: str) -> User:
+async def authenticate_user_challenge(db: AsyncSession, redis_client: redis.Redis, public_key: str, signature: str) -> User:
     """
     Authenticates a user by verifying their signature against a stored challenge.
     Returns the User object if successful, otherwise returns None.
     """
-    db_user = get_user_by_public_key(db, public_key)
+    db_user = await get_user_by_public_key_async(db, public_key)
     if not db_user:
         return None
     try:
@@ -90,31 +105,36 @@ async def authenticate_user_challenge(db: Session, redis_client: redis.Redis, pu
 def get_user_by_id(db: Session, user_id: uuid.UUID):
     return db.query(User).filter(User.user_id == user_id).first()
 
-def update_user_scores(db: Session, user: User, new_scores: dict):
+def fold_user_score_sums(db: Session, user_id: uuid.UUID, score_sums: dict, post_count: int, commit: bool = True) -> bool:
     """
-    Updates a user's average scores with new scores from a post.
-    """
-    if not user:
-        return None
+    Folds `post_count` posts into a user's running averages in one UPDATE, given
+    the per-key sum of their scores:
 
-    current_post_count = user.total_posts_count
-    
-    for key in PERSONALITY_KEYS:
-        new_score = new_scores.get(key)
-        if new_score is not None:
-            current_avg_attr = f"avg_{key}_score"
-            current_avg = getattr(user, current_avg_attr, 0.5)
-            new_avg = ((current_avg * current_post_count) + new_score) / (current_post_count + 1)
-            setattr(user, current_avg_attr, new_avg)
+        avg_x = (avg_x * total_posts_count + :sum_x) / (total_posts_count + :n),
+        total_posts_count = total_posts_count + :n
 
-    user.total_posts_count += 1
-    user.updated_at = datetime.now(timezone.utc)
+    The result is identical to applying the posts one at a time. Every
+    right-hand side sees the pre-update row and the row lock serializes
+    concurrent workers, so parallel posts from the same user never lose updates.
+    No prior SELECT or refresh is needed. Returns False if the user does not exist.
+    """
+    count = User.total_posts_count
+    values = {
+        "total_posts_count": count + post_count,
+        "updated_at": datetime.now(timezone.utc),
+    }
+    for key in PERSONALITY_KEYS:
+        score_sum = score_sums.get(key)
+        if score_sum is not None:
+            column = getattr(User, f"avg_{key}_score")
+            values[f"avg_{key}_score"] = (column * count + float(score_sum)) / cast(count + post_count, Float)
 
+    stmt = update(User).where(User.user_id == user_id).values(**values).execution_options(synchronize_session=False)
     try:
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
+        result = db.execute(stmt)
+        if commit:
+            db.commit()
+        return result.rowcount == 1
     except Exception as e:
         db.rollback()
         raise e
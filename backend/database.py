@@ -1,6 +1,6 @@
 # backend/database.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import StaticPool # For SQLite in-memory testing if needed, remove for production PostgreSQL
 
@@ -15,6 +15,9 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/sil
 # For production, remove connect_args and poolclass if not using SQLite in-memory
 engine = create_engine(
     DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
     pool_pre_ping=True # Ensures connections are alive
 )
 
@@ -40,3 +43,22 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# create_all() only creates missing tables, so columns and indexes added after
+# a table first shipped are applied here. Every statement must be idempotent.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS idx_posts_unscored ON posts (created_at) WHERE scored_at IS NULL",
+    # Posts scored before the ledger existed were already counted
+    "UPDATE posts SET scored_at = COALESCE(updated_at, created_at) WHERE scored_at IS NULL AND sentiment_scores_json IS NOT NULL",
+    # Existing JSON scores are copied over by migrate_post_scores.py
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS sentiment_scores REAL[]",
+    # Lets retention and sweeps find the oldest posts without scanning the table
+    "CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at)",
+]
+
+def apply_schema_upgrades():
+    """Brings an existing database up to the current models."""
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
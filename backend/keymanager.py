@@ -21,9 +21,14 @@ def read_keys() -> List[str]:
         return json.load(f)
 
 def write_keys(keys: List[str]):
-    """Writes the list of keys to the keys file."""
-    with open(KEYS_FILE, 'w') as f:
+    """
+    Writes the list of keys to the keys file. The file is replaced atomically,
+    so the backend never reads a half-written key ring.
+    """
+    tmp_file = f"{KEYS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
         json.dump(keys, f, indent=2)
+    os.replace(tmp_file, KEYS_FILE)
 
 def initialize_keys():
     """
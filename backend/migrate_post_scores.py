@@ -0,0 +1,48 @@
+# backend/migrate_post_scores.py
+"""
+Moves scores from the legacy posts.sentiment_scores_json column into the
+sentiment_scores REAL[] column, in id-ordered batches, and clears the JSON.
+Rows written as a JSON string holding a JSON object are decoded too. Safe to
+interrupt and re-run; it only touches rows that still have JSON.
+
+    python migrate_post_scores.py [--batch-size 5000]
+
+Run VACUUM (or let autovacuum) reclaim the space of the old row versions afterwards.
+"""
+import argparse
+import logging
+import time
+
+from database import SessionLocal
+from crud.sentiment import migrate_json_scores_after
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate JSON post scores to the REAL[] column")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    migrated, batches, started = 0, 0, time.monotonic()
+    last_post_id = None
+    try:
+        while True:
+            last_post_id = migrate_json_scores_after(db, last_post_id, args.batch_size)
+            db.commit()
+            if last_post_id is None:
+                break
+            batches += 1
+            migrated += args.batch_size
+            if batches % 20 == 0:
+                logging.info(f"Migrated about {migrated} posts ({migrated / (time.monotonic() - started):.0f}/s).")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Migration stopped: {e}. Re-run to continue.")
+        raise
+    finally:
+        db.close()
+    logging.info(f"Post score migration finished in {time.monotonic() - started:.0f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from datetime import datetime, timezone
 from sqlalchemy import Column, Integer, String, Float, DateTime, UniqueConstraint, Index, text, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, REAL
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from silhouet_config import PERSONALITY_KEYS # Import from shared config
@@ -88,13 +88,37 @@ class Post(Base):
     raw_text = Column(String, nullable=False)
     # <<< ADD THESE NEW COLUMNS
     category = Column(String, nullable=True) # Optional in Pydantic means nullable in DB
-    sentiment_scores_json = Column(JSONB, nullable=True) # To store the dictionary of scores
-   # If JSONB doesn't work out of the box, you can use TEXT and store json.dumps()
-   # sentiment_scores_json = Column(TEXT, nullable=True) 
+    # Legacy score storage, emptied by migrate_post_scores.py
+    sentiment_scores_json = Column(JSONB, nullable=True)
    # >>>
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # One float32 per personality key, in PERSONALITY_KEYS order
+    sentiment_scores = Column(ARRAY(REAL), nullable=True)
+    # Set in the same transaction that folds the scores into the user's averages;
+    # a post with scored_at set is never counted again.
+    scored_at = Column(DateTime(timezone=True), nullable=True)
+    # Part of the primary key because posts is range-partitioned on it (see post_partitions.py)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), primary_key=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        Index('idx_posts_unscored', 'created_at', postgresql_where=text('scored_at IS NULL')),
+        Index('idx_posts_created_at', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class RescoreCheckpoint(Base):
+    """Progress of a rescore_posts.py run, committed with each batch so a run can resume."""
+    __tablename__ = "rescore_checkpoints"
+
+    name = Column(String(100), primary_key=True)
+    phase = Column(String(20), nullable=False, default="posts")  # 'posts', 'averages' or 'done'
+    last_post_id = Column(PG_UUID(as_uuid=True), nullable=True)
+    last_user_id = Column(PG_UUID(as_uuid=True), nullable=True)
+    posts_done = Column(Integer, nullable=False, default=0)
+    users_done = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
 # =====================
 # Advertiser & Campaign Models
 # =====================
@@ -0,0 +1,169 @@
+# backend/post_partitions.py
+"""
+Range partitioning of the posts table on created_at.
+
+Partitions are named posts_pYYYYMMDD after their first day and cover one
+POSTS_PARTITION_INTERVAL ('month' or 'week', in UTC). Retention drops whole
+partitions instead of deleting rows, so it takes the same time however many
+posts expire, leaves no dead tuples behind and needs no vacuum.
+
+    python post_partitions.py maintain   # create upcoming partitions, drop expired ones (daily, from cron)
+    python post_partitions.py convert    # one-time: move an existing unpartitioned posts table into partitions
+
+A partition is dropped once its whole range is older than POSTS_RETENTION_DAYS,
+so posts are kept for up to one interval longer than the retention period.
+Set POSTS_DETACH_ONLY=true to detach expired partitions and keep them as
+standalone tables (e.g. for archiving) instead of dropping them.
+"""
+import os
+import re
+import sys
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from database import engine
+from models import Post
+
+POSTS_PARTITION_INTERVAL = os.getenv("POSTS_PARTITION_INTERVAL", "month")
+POSTS_PARTITIONS_AHEAD = int(os.getenv("POSTS_PARTITIONS_AHEAD", "3"))
+POSTS_RETENTION_DAYS = int(os.getenv("POSTS_RETENTION_DAYS", "31"))
+POSTS_DETACH_ONLY = os.getenv("POSTS_DETACH_ONLY", "false").lower() == "true"
+
+PARTITION_NAME = re.compile(r"^posts_p(\d{8})$")
+
+def interval_start(day: date) -> date:
+    if POSTS_PARTITION_INTERVAL == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def next_interval_start(start: date) -> date:
+    if POSTS_PARTITION_INTERVAL == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(start: date) -> str:
+    return f"posts_p{start:%Y%m%d}"
+
+def last_partition_start(today: date) -> date:
+    """First day of the furthest partition kept ready ahead of time."""
+    start = interval_start(today)
+    for _ in range(POSTS_PARTITIONS_AHEAD):
+        start = next_interval_start(start)
+    return start
+
+def is_partitioned(conn) -> bool:
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('posts')")).scalar()
+    return relkind == "p"
+
+def existing_partitions(conn) -> List[str]:
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('posts')
+    """))
+    return [row.relname for row in rows]
+
+def create_partitions(conn, first: date, last: date):
+    """Creates any missing partitions covering the days first..last."""
+    start = interval_start(first)
+    while start <= last:
+        end = next_interval_start(start)
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF posts
+            FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')
+        """))
+        start = end
+
+def expired_partitions(conn, today: date) -> List[Tuple[str, date]]:
+    cutoff = today - timedelta(days=POSTS_RETENTION_DAYS)
+    expired = []
+    for name in existing_partitions(conn):
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        start = datetime.strptime(match.group(1), "%Y%m%d").date()
+        if next_interval_start(start) <= cutoff:
+            expired.append((name, start))
+    return sorted(expired, key=lambda item: item[1])
+
+def ensure_post_partitions() -> bool:
+    """
+    Creates the partitions for the current interval and POSTS_PARTITIONS_AHEAD
+    following ones. Returns False if posts is not partitioned yet.
+    """
+    today = datetime.now(timezone.utc).date()
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return False
+        create_partitions(conn, today, last_partition_start(today))
+    return True
+
+def drop_expired_partitions() -> int:
+    today = datetime.now(timezone.utc).date()
+    with engine.begin() as conn:
+        expired = expired_partitions(conn, today)
+
+    # DETACH ... CONCURRENTLY does not block inserts into posts, but cannot run
+    # inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, _ in expired:
+            conn.execute(text(f"ALTER TABLE posts DETACH PARTITION {name} CONCURRENTLY"))
+            if POSTS_DETACH_ONLY:
+                logging.info(f"Detached expired partition {name}.")
+            else:
+                conn.execute(text(f"DROP TABLE {name}"))
+                logging.info(f"Dropped expired partition {name}.")
+    return len(expired)
+
+def maintain():
+    if not ensure_post_partitions():
+        logging.warning("posts is not partitioned. Run 'python post_partitions.py convert' first.")
+        return
+    logging.info(f"Partitions ensured through {POSTS_PARTITIONS_AHEAD} upcoming {POSTS_PARTITION_INTERVAL}s.")
+    dropped = drop_expired_partitions()
+    logging.info(f"Partition maintenance finished ({dropped} expired partitions removed).")
+
+def convert():
+    """
+    Replaces an unpartitioned posts table with a partitioned one holding the
+    same rows. Blocks reads and writes of posts while rows are copied; run it
+    during a maintenance window. The old table is kept as posts_unpartitioned
+    and can be dropped once the result is verified.
+    """
+    today = datetime.now(timezone.utc).date()
+    columns = ", ".join(column.name for column in Post.__table__.columns)
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            logging.info("posts is already partitioned.")
+            return
+        conn.execute(text("LOCK TABLE posts IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text("ALTER TABLE posts RENAME TO posts_unpartitioned"))
+        for index in ["posts_pkey", "ix_posts_id", "ix_posts_user_id", "idx_posts_unscored", "idx_posts_created_at"]:
+            conn.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned"))
+        conn.execute(text("UPDATE posts_unpartitioned SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL"))
+
+        Post.__table__.create(conn)
+        oldest = conn.execute(text("SELECT MIN(created_at) FROM posts_unpartitioned")).scalar()
+        first = oldest.astimezone(timezone.utc).date() if oldest else today
+        last = last_partition_start(today)
+        create_partitions(conn, first, last)
+        copied = conn.execute(text(f"INSERT INTO posts ({columns}) SELECT {columns} FROM posts_unpartitioned")).rowcount
+    logging.info(f"Moved {copied} posts into partitions from {interval_start(first)} to {last}. "
+                 "The old table is kept as posts_unpartitioned.")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] not in ("maintain", "convert"):
+        logging.error("Usage: python post_partitions.py [maintain|convert]")
+        sys.exit(1)
+    if sys.argv[1] == "maintain":
+        maintain()
+    else:
+        convert()
+
+if __name__ == "__main__":
+    main()
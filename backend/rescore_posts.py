@@ -0,0 +1,194 @@
+# backend/rescore_posts.py
+"""
+Rescores every scored post and updates user averages, for use after
+PERSONALITY_LABEL_MAP, SENSITIVITY_MASKS or SCALE_FACTOR change.
+
+    python rescore_posts.py [--run NAME] [--batch-size 64] [--restart] [--reset-averages [--averages-only]]
+
+Walks posts in id order (keyset pagination), scores each page with one request
+to the model's /score/batch endpoint and, in one statement, overwrites the
+stored scores and moves each owner's running averages by the difference
+(new - old) / total_posts_count. total_posts_count is unchanged and posts
+already removed by retention keep their original contribution. The checkpoint
+in rescore_checkpoints is committed together with every page, so an
+interrupted run continues where it stopped when started again with the same
+--run name. When the model service is saturated (503), times out or has its
+circuit breaker open, the page is retried with exponential backoff instead of
+stopping the run. Pages are kept small (--batch-size 64) so a rescore request
+fits beside live traffic in the model's inference queue.
+
+--reset-averages adds a second phase that instead rebuilds avg_*_score and
+total_posts_count from the posts still in the table. This discards the
+history of expired posts: all-time averages become averages over the
+retention window. Posts scored by the live pipeline while it runs may be
+missed for users it has already passed.
+"""
+import argparse
+import logging
+import time
+
+import httpx
+from sqlalchemy import text
+
+from database import SessionLocal
+from models import RescoreCheckpoint
+from crud.sentiment import fetch_scored_posts_after, overwrite_post_scores, recompute_user_averages
+from workers.model_client import score_texts, ModelUnavailableError, MODEL_BREAKER_RESET_SECONDS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 120.0
+
+class Progress:
+    """Logs done/total, rate and ETA every `every` items."""
+
+    def __init__(self, label: str, total: int, done: int, every: int):
+        self.label = label
+        self.total = total
+        self.start_done = done
+        self.done = done
+        self.every = every
+        self.next_report = done + every
+        self.started = time.monotonic()
+
+    def advance(self, count: int, force: bool = False):
+        self.done += count
+        if self.done < self.next_report and not force:
+            return
+        self.next_report = self.done + self.every
+        elapsed = time.monotonic() - self.started
+        rate = (self.done - self.start_done) / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.done, 0)
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "n/a"
+        logging.info(f"{self.label}: {self.done}/{self.total} ({rate:.1f}/s, ETA {eta})")
+
+def score_page(texts, max_attempts: int):
+    """
+    Scores a page of texts, backing off and retrying while the model service is
+    saturated, timing out or behind an open circuit breaker. Other errors, and
+    the last transient one once max_attempts are used up, are raised.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return score_texts(texts)
+        except ModelUnavailableError as e:
+            reason, floor = str(e), MODEL_BREAKER_RESET_SECONDS
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500 or attempt == max_attempts:
+                raise
+            reason, floor = f"model service returned {e.response.status_code}", 0.0
+        except httpx.TransportError as e:
+            if attempt == max_attempts:
+                raise
+            reason, floor = f"{type(e).__name__}: {e}", 0.0
+        if attempt == max_attempts:
+            raise ModelUnavailableError(reason)
+        delay = max(floor, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+        logging.warning(f"Scoring {len(texts)} posts failed ({reason}); retry {attempt}/{max_attempts - 1} in {delay:.0f}s.")
+        time.sleep(delay)
+
+def load_checkpoint(db, name: str, restart: bool, averages_only: bool) -> RescoreCheckpoint:
+    checkpoint = db.get(RescoreCheckpoint, name)
+    if checkpoint is None or restart:
+        if checkpoint is None:
+            checkpoint = RescoreCheckpoint(name=name)
+            db.add(checkpoint)
+        checkpoint.phase = "posts"
+        checkpoint.last_post_id = None
+        checkpoint.last_user_id = None
+        checkpoint.posts_done = 0
+        checkpoint.users_done = 0
+    if averages_only and checkpoint.phase != "averages":
+        checkpoint.phase = "averages"
+        checkpoint.last_user_id = None
+        checkpoint.users_done = 0
+    db.commit()
+    return checkpoint
+
+def rescore_posts(db, checkpoint: RescoreCheckpoint, batch_size: int, report_every: int, next_phase: str, max_attempts: int):
+    remaining = db.execute(
+        text("SELECT COUNT(*) FROM posts WHERE scored_at IS NOT NULL AND (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid))"),
+        {"after": str(checkpoint.last_post_id) if checkpoint.last_post_id else None},
+    ).scalar()
+    progress = Progress("Posts rescored", checkpoint.posts_done + remaining, checkpoint.posts_done, report_every)
+
+    unfolded = 0
+    while True:
+        page = fetch_scored_posts_after(db, checkpoint.last_post_id, batch_size)
+        if not page:
+            break
+        scores = score_page([raw_text for _, raw_text in page], max_attempts)
+        updated, without_previous = overwrite_post_scores(db, {str(post_id): post_scores for (post_id, _), post_scores in zip(page, scores)})
+        checkpoint.last_post_id = page[-1][0]
+        checkpoint.posts_done += updated
+        db.commit()
+        unfolded += without_previous
+        progress.advance(updated)
+
+    checkpoint.phase = next_phase
+    db.commit()
+    progress.advance(0, force=True)
+    if unfolded:
+        logging.warning(f"{unfolded} posts had no previous score array (run migrate_post_scores.py first); "
+                        "their new scores were stored but not folded into user averages.")
+
+def recompute_averages(db, checkpoint: RescoreCheckpoint, batch_size: int, report_every: int):
+    total_users = db.execute(text("SELECT COUNT(*) FROM users")).scalar()
+    progress = Progress("Users recomputed", total_users, checkpoint.users_done, report_every)
+
+    while True:
+        visited, last_user_id = recompute_user_averages(db, checkpoint.last_user_id, batch_size)
+        if last_user_id is None:
+            break
+        checkpoint.last_user_id = last_user_id
+        checkpoint.users_done += visited
+        db.commit()
+        progress.advance(visited)
+
+    checkpoint.phase = "done"
+    db.commit()
+    progress.advance(0, force=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rescore all posts and recompute user averages")
+    parser.add_argument("--run", default="default", help="Checkpoint name; reuse it to resume an interrupted run")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Posts per model request; well below MODEL_INFERENCE_QUEUE_DEPTH so live posts still fit")
+    parser.add_argument("--max-attempts", type=int, default=10, help="Attempts per page while the model service is unavailable")
+    parser.add_argument("--user-batch-size", type=int, default=2000, help="Users per averages UPDATE with --reset-averages")
+    parser.add_argument("--report-every", type=int, default=5000, help="Log progress every N posts or users")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint and start from the first post")
+    parser.add_argument("--reset-averages", action="store_true",
+                        help="After rescoring, rebuild averages and post counts from the posts still in the table, discarding expired posts")
+    parser.add_argument("--averages-only", action="store_true", help="Skip rescoring; with --reset-averages, only rebuild averages")
+    args = parser.parse_args()
+    if args.averages_only and not args.reset_averages:
+        parser.error("--averages-only rebuilds averages from retained posts only; pass --reset-averages as well to confirm")
+
+    db = SessionLocal()
+    try:
+        checkpoint = load_checkpoint(db, args.run, args.restart, args.averages_only)
+        if checkpoint.phase == "done":
+            logging.info(f"Run '{args.run}' already finished. Use --restart to run it again.")
+            return
+        logging.info(f"Run '{args.run}': starting in phase '{checkpoint.phase}' "
+                     f"({checkpoint.posts_done} posts, {checkpoint.users_done} users already done).")
+        if checkpoint.phase == "posts":
+            rescore_posts(db, checkpoint, args.batch_size, args.report_every,
+                          "averages" if args.reset_averages else "done", args.max_attempts)
+        if checkpoint.phase == "averages":
+            if not args.reset_averages:
+                logging.error(f"Run '{args.run}' stopped while resetting averages. Re-run with --reset-averages to finish it.")
+                return
+            recompute_averages(db, checkpoint, args.user_batch_size, args.report_every)
+        logging.info(f"Run '{args.run}' finished.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Rescore run '{args.run}' stopped: {e}. Re-run with --run {args.run} to resume.")
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
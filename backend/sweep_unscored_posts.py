@@ -0,0 +1,34 @@
+# backend/sweep_unscored_posts.py
+"""
+Re-enqueues posts that are still unscored SENTIMENT_SWEEP_AFTER_SECONDS after
+they were created: posts whose task or batch was lost when a worker died, or
+that ran out of retries while the model service was down. Run from cron:
+
+    python sweep_unscored_posts.py
+
+Re-enqueuing a post that is merely slow is harmless; scored_at guarantees its
+scores are only counted once.
+"""
+import os
+
+from database import SessionLocal
+from crud.sentiment import find_unscored_posts
+from workers.celery_worker import enqueue_post_sentiment
+
+SWEEP_AFTER_SECONDS = int(os.getenv("SENTIMENT_SWEEP_AFTER_SECONDS", "600"))
+SWEEP_MAX_AGE_HOURS = int(os.getenv("SENTIMENT_SWEEP_MAX_AGE_HOURS", "24"))
+SWEEP_LIMIT = int(os.getenv("SENTIMENT_SWEEP_LIMIT", "1000"))
+
+def main():
+    db = SessionLocal()
+    try:
+        stale = find_unscored_posts(db, SWEEP_AFTER_SECONDS, SWEEP_MAX_AGE_HOURS, SWEEP_LIMIT)
+    finally:
+        db.close()
+
+    for post_id, user_id, raw_text in stale:
+        enqueue_post_sentiment(str(post_id), str(user_id), raw_text)
+    print(f"Sweep: Re-enqueued {len(stale)} posts unscored for more than {SWEEP_AFTER_SECONDS}s.")
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,42 @@ from sqlalchemy.orm import Session
 import uuid
 import json
 import redis
+from collections import defaultdict
 from datetime import datetime
+from typing import Dict, List
 from database import SessionLocal
-from models import Post, User
-from crud.users import update_user_scores
+from crud.users import fold_user_score_sums
+from crud.sentiment import bulk_update_post_scores
 from silhouet_config import PERSONALITY_KEYS
 
+from workers.model_client import score_text, score_texts, ModelResponseError, ModelUnavailableError, MODEL_BREAKER_RESET_SECONDS
 from workers.ads_worker import push_ads_for_campaign
 from workers.insight_worker import push_insight
+from workers.message_queue import sentiment_channel_for_user
 
 from dotenv import load_dotenv
 load_dotenv()
 
 REDIS_BROKER_URL = os.getenv("REDIS_BROKER_URL", "redis://redis:6379/0")
-MODEL_SERVICE_URL = os.getenv("MODEL_SERVICE_URL", "http://model:8001/score")
 
-# Define the Redis Pub/Sub channel name (must match backend's listener)
-PUBSUB_CHANNEL = "sentiment_updates"
+
+# --- Batched sentiment scoring ---
+# With batching on, new posts are pushed onto a Redis list and drained by
+# drain_post_sentiment_batch_task, which scores up to SENTIMENT_BATCH_SIZE posts
+# with one model request and persists them in one transaction. A drain runs as
+# soon as a full batch is pending, or SENTIMENT_BATCH_WINDOW_MS after the first
+# post of a partial batch.
+SENTIMENT_BATCH_MODE = os.getenv("SENTIMENT_BATCH_MODE", "true").lower() == "true"
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+SENTIMENT_BATCH_WINDOW_MS = int(os.getenv("SENTIMENT_BATCH_WINDOW_MS", "250"))
+SENTIMENT_BATCH_MAX_ATTEMPTS = int(os.getenv("SENTIMENT_BATCH_MAX_ATTEMPTS", "5"))
+SENTIMENT_PENDING_QUEUE = "sentiment:pending"
+# Each drain moves the batch it works on into its own list, removed only once
+# the batch is committed or re-queued
+SENTIMENT_PROCESSING_PREFIX = "sentiment:processing"
+SENTIMENT_DRAIN_SCHEDULED_KEY = "sentiment:drain_scheduled"
+SENTIMENT_TASK_MAX_DELIVERIES = int(os.getenv("SENTIMENT_TASK_MAX_DELIVERIES", "3"))
+SENTIMENT_DELIVERIES_PREFIX = "sentiment:deliveries"
 
 # Initialize Celery app
 celery_app = Celery(
@@ -38,6 +57,16 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Tasks are acknowledged only after they finish, so a task whose worker
+    # died is redelivered. Replays are harmless because persist_sentiment_scores
+    # ignores posts that already have scored_at. A redelivered drain finishes
+    # the batch left in its processing list (see drain_post_sentiment_batch_task).
+    # A task that kills its worker (e.g. OOM) would be redelivered forever, so
+    # deliveries are capped at SENTIMENT_TASK_MAX_DELIVERIES; posts given up on
+    # are left to sweep_unscored_posts.py.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
 )
 
 try:
@@ -48,68 +77,267 @@ except Exception as e:
     print(f"Celery Worker: CRITICAL: Failed to connect Redis publisher client: {e}")
     redis_publisher_client = None
 
-@celery_app.task(name="process_post_sentiment")
-def process_post_sentiment_task(post_id: str, raw_text: str):
+def delivery_limit_exceeded(task_id: str) -> bool:
+    """
+    Counts a delivery of a sentiment task and returns True once the task has
+    been delivered more than SENTIMENT_TASK_MAX_DELIVERIES times, i.e. it keeps
+    dying with its worker. The count is cleared when the task finishes.
+    """
+    if redis_publisher_client is None or task_id is None:
+        return False
+    key = f"{SENTIMENT_DELIVERIES_PREFIX}:{task_id}"
+    pipe = redis_publisher_client.pipeline(transaction=True)
+    pipe.incr(key)
+    pipe.expire(key, 24 * 3600)
+    deliveries, _ = pipe.execute()
+    return deliveries > SENTIMENT_TASK_MAX_DELIVERIES
+
+def clear_deliveries(task_id: str):
+    if redis_publisher_client is None or task_id is None:
+        return
+    try:
+        redis_publisher_client.delete(f"{SENTIMENT_DELIVERIES_PREFIX}:{task_id}")
+    except Exception as e:
+        print(f"Task: Could not clear delivery count for {task_id}: {e}")
+
+def sentiment_update_payload(post_id: str, user_id: str, raw_text: str, scores: dict) -> str:
+    return json.dumps({
+        "type": "post_sentiment_update",
+        "post_id": post_id,
+        "user_id": user_id,
+        "raw_text": raw_text,
+        "sentiment_scores": scores,
+        "timestamp": datetime.utcnow().isoformat() + "Z"
+    })
+
+def persist_sentiment_scores(db: Session, jobs_by_post: Dict[str, dict], scores_by_post: Dict[str, dict]) -> List[dict]:
+    """
+    Saves scores for posts that have none yet and folds them into their users'
+    running averages in one transaction: one UPDATE on posts, then one UPDATE
+    per distinct user, in user_id order. Returns the jobs that were scored by this call; posts
+    that were already scored or no longer exist are skipped.
+    """
+    scored = bulk_update_post_scores(db, scores_by_post)
+
+    score_sums = defaultdict(lambda: dict.fromkeys(PERSONALITY_KEYS, 0.0))
+    post_counts = defaultdict(int)
+    fresh_jobs = []
+    for post_id, owner_id in scored:
+        job = jobs_by_post[str(post_id)]
+        # Tasks queued before the payload carried user_id fall back to the row's owner
+        job["user_id"] = job.get("user_id") or str(owner_id)
+        for key, value in scores_by_post[job["post_id"]].items():
+            score_sums[job["user_id"]][key] += value
+        post_counts[job["user_id"]] += 1
+        fresh_jobs.append(job)
+
+    # Locking users in a fixed order keeps concurrent drains with overlapping users from deadlocking
+    for user_id in sorted(score_sums):
+        if not fold_user_score_sums(db, uuid.UUID(user_id), score_sums=score_sums[user_id], post_count=post_counts[user_id], commit=False):
+            print(f"Task: User {user_id} not found. Cannot update scores.")
+    db.commit()
+    return fresh_jobs
+
+@celery_app.task(name="process_post_sentiment", bind=True)
+def process_post_sentiment_task(self, post_id: str, raw_text: str, user_id: str = None):
     print(f"Task: Processing sentiment for Post ID: {post_id}")
-    
+    if delivery_limit_exceeded(self.request.id):
+        print(f"Task: Post {post_id}: Delivered more than {SENTIMENT_TASK_MAX_DELIVERIES} times. Giving up.")
+        clear_deliveries(self.request.id)
+        return
+
     db: Session = None
     try:
-        db = SessionLocal() 
-        db_post = db.query(Post).filter(Post.id == uuid.UUID(post_id)).first()
+        returned_scores = score_text(raw_text)
+        if not returned_scores:
+            print(f"Task: Post {post_id}: Empty sentiment scores received from model.")
+            return
 
-        if not db_post:
-            print(f"Task: Post {post_id} not found in DB. Skipping sentiment analysis.")
+        db = SessionLocal()
+        job = {"post_id": post_id, "user_id": user_id, "raw_text": raw_text}
+        if not persist_sentiment_scores(db, {post_id: job}, {post_id: returned_scores}):
+            print(f"Task: Post {post_id}: Already scored or no longer exists. Skipping.")
             return
+        print(f"Task: Post {post_id}: Sentiment scores saved and user {job['user_id']} averages updated.")
 
-        response = httpx.post(MODEL_SERVICE_URL, json=({"text": raw_text}))
-        response.raise_for_status()
-        sentiment_data = json.loads(response.json())
-        returned_scores = sentiment_data.get("scores")
-
-        if returned_scores and isinstance(returned_scores, dict):
-            db_post.sentiment_scores_json = json.dumps(returned_scores)
-            db.add(db_post)
-            db.commit()
-            db.refresh(db_post)
-            print(f"Task: Post {post_id}: Sentiment scores saved to post.")
-
-            # --- UPDATE USER SCORES ---
-            db_user = db.query(User).filter(User.user_id == db_post.user_id).first()
-            if db_user:
-                update_user_scores(db, user=db_user, new_scores=returned_scores)
-                print(f"Task: User {db_user.user_id}: Average scores updated.")
-            else:
-                print(f"Task: User not found for post {post_id}. Cannot update scores.")
-            # --- END UPDATE ---
-
-            if redis_publisher_client:
-                try:
-                    update_payload = {
-                        "type": "post_sentiment_update",
-                        "post_id": post_id,
-                        "user_id": str(db_post.user_id),
-                        "raw_text": raw_text,
-                        "sentiment_scores": returned_scores,
-                        "timestamp": datetime.utcnow().isoformat() + "Z"
-                    }
-                    redis_publisher_client.publish(PUBSUB_CHANNEL, json.dumps(update_payload))
-                    print(f"Task: Published sentiment update for post {post_id} to Redis channel '{PUBSUB_CHANNEL}'.")
-                except Exception as pub_exc:
-                    print(f"Task: Error publishing sentiment update for post {post_id} to Redis: {pub_exc}")
-            else:
-                print("Task: Redis publisher client not initialized. Cannot publish update.")
+        if redis_publisher_client:
+            try:
+                update_payload = sentiment_update_payload(post_id, job["user_id"], raw_text, returned_scores)
+                channel = sentiment_channel_for_user(job["user_id"])
+                redis_publisher_client.publish(channel, update_payload)
+                print(f"Task: Published sentiment update for post {post_id} to Redis channel '{channel}'.")
+            except Exception as pub_exc:
+                print(f"Task: Error publishing sentiment update for post {post_id} to Redis: {pub_exc}")
         else:
-            print(f"Task: Post {post_id}: Invalid sentiment scores received from model: {sentiment_data}")
+            print("Task: Redis publisher client not initialized. Cannot publish update.")
 
     except httpx.RequestError as exc:
         print(f"Task: Post {post_id}: An error occurred while requesting model service: {exc}")
     except httpx.HTTPStatusError as exc:
         print(f"Task: Post {post_id}: Model service returned an error status {exc.response.status_code}: {exc.response.text}")
+    except ModelResponseError as exc:
+        print(f"Task: Post {post_id}: Invalid sentiment scores received from model: {exc}")
+    except ModelUnavailableError as exc:
+        print(f"Task: Post {post_id}: Skipped, model service unavailable: {exc}")
     except Exception as exc:
+        if db:
+            db.rollback()
         print(f"Task: Post {post_id}: An unexpected error occurred in task: {exc}")
     finally:
         if db:
             db.close()
+        clear_deliveries(self.request.id)
+
+def enqueue_post_sentiment(post_id: str, user_id: str, raw_text: str):
+    """
+    Queues a post for sentiment scoring. In batch mode the post joins the
+    pending list and a drain is scheduled; otherwise (or if Redis is
+    unavailable) it gets its own process_post_sentiment_task.
+    """
+    if not SENTIMENT_BATCH_MODE or redis_publisher_client is None:
+        process_post_sentiment_task.delay(post_id, raw_text, user_id)
+        return
+
+    pending = redis_publisher_client.rpush(
+        SENTIMENT_PENDING_QUEUE, json.dumps({"post_id": post_id, "user_id": user_id, "raw_text": raw_text, "attempts": 0})
+    )
+    # One immediate drain per full batch pushed, not one per post: during a
+    # backlog the list stays above SENTIMENT_BATCH_SIZE for every push
+    if pending % SENTIMENT_BATCH_SIZE == 0:
+        drain_post_sentiment_batch_task.delay()
+    # Otherwise only the first post of a partial batch schedules the delayed
+    # drain. The key outlives the window so a lost drain does not strand the
+    # queue for long.
+    elif redis_publisher_client.set(SENTIMENT_DRAIN_SCHEDULED_KEY, 1, nx=True, px=SENTIMENT_BATCH_WINDOW_MS * 20):
+        drain_post_sentiment_batch_task.apply_async(countdown=SENTIMENT_BATCH_WINDOW_MS / 1000)
+
+def requeue_sentiment_jobs(jobs: List[dict], countdown: float = None):
+    """
+    Pushes a failed batch back onto the pending list and schedules a delayed
+    drain. Each call counts as an attempt unless an explicit countdown is given
+    (used while the model client's circuit breaker is open).
+    """
+    retry, dropped = [], []
+    for job in jobs:
+        if countdown is None:
+            job["attempts"] = job.get("attempts", 0) + 1
+        (retry if job.get("attempts", 0) < SENTIMENT_BATCH_MAX_ATTEMPTS else dropped).append(job)
+    for job in dropped:
+        print(f"Batch: Post {job['post_id']}: Giving up after {job['attempts']} attempts.")
+    if retry:
+        redis_publisher_client.rpush(SENTIMENT_PENDING_QUEUE, *(json.dumps(job) for job in retry))
+        if countdown is None:
+            countdown = min(2 ** max(job["attempts"] for job in retry), 60)
+        drain_post_sentiment_batch_task.apply_async(countdown=countdown)
+
+def process_sentiment_batch(jobs: List[dict]) -> bool:
+    """
+    Scores and persists a batch of pending posts:
+    one /score/batch request, one UPDATE for all posts, one UPDATE per distinct
+    user and a single commit, then one Redis pipeline for all notifications.
+    Returns False if the batch was re-queued.
+    """
+    # The last occurrence wins if a post was queued twice
+    jobs_by_post = {job["post_id"]: job for job in jobs}
+    post_ids = list(jobs_by_post)
+
+    try:
+        returned_scores = score_texts([jobs_by_post[post_id]["raw_text"] for post_id in post_ids])
+    except httpx.RequestError as exc:
+        print(f"Batch: Error requesting model service for {len(post_ids)} posts: {exc}")
+        requeue_sentiment_jobs(jobs)
+        return False
+    except httpx.HTTPStatusError as exc:
+        print(f"Batch: Model service returned an error status {exc.response.status_code}: {exc.response.text}")
+        requeue_sentiment_jobs(jobs)
+        return False
+    except ModelResponseError as exc:
+        print(f"Batch: Invalid sentiment scores received from model: {exc}")
+        requeue_sentiment_jobs(jobs)
+        return False
+    except ModelUnavailableError as exc:
+        print(f"Batch: Model service unavailable, deferring {len(post_ids)} posts: {exc}")
+        requeue_sentiment_jobs(jobs, countdown=MODEL_BREAKER_RESET_SECONDS)
+        return False
+
+    scores_by_post = dict(zip(post_ids, returned_scores))
+
+    db: Session = None
+    try:
+        db = SessionLocal()
+        scored_jobs = persist_sentiment_scores(db, jobs_by_post, scores_by_post)
+    except Exception as exc:
+        if db:
+            db.rollback()
+        print(f"Batch: Error persisting sentiment scores for {len(post_ids)} posts: {exc}")
+        requeue_sentiment_jobs(jobs)
+        return False
+    finally:
+        if db:
+            db.close()
+
+    print(f"Batch: Saved sentiment scores for {len(scored_jobs)} posts "
+          f"({len(post_ids) - len(scored_jobs)} already scored or deleted).")
+
+    try:
+        pipe = redis_publisher_client.pipeline(transaction=False)
+        for job in scored_jobs:
+            pipe.publish(sentiment_channel_for_user(job["user_id"]), sentiment_update_payload(job["post_id"], job["user_id"], job["raw_text"], scores_by_post[job["post_id"]]))
+        pipe.execute()
+    except Exception as pub_exc:
+        print(f"Batch: Error publishing {len(scored_jobs)} sentiment updates to Redis: {pub_exc}")
+    return True
+
+def claim_sentiment_jobs(processing_key: str):
+    """
+    Returns the jobs in `processing_key` if a previous delivery of this drain
+    died before finishing them, otherwise atomically moves up to
+    SENTIMENT_BATCH_SIZE pending jobs into it. Returns (raw jobs, recovered).
+    """
+    leftover = redis_publisher_client.lrange(processing_key, 0, -1)
+    if leftover:
+        return leftover, True
+    pipe = redis_publisher_client.pipeline(transaction=True)
+    for _ in range(SENTIMENT_BATCH_SIZE):
+        pipe.lmove(SENTIMENT_PENDING_QUEUE, processing_key, "LEFT", "RIGHT")
+    return [raw for raw in pipe.execute() if raw is not None], False
+
+@celery_app.task(name="drain_post_sentiment_batch", bind=True)
+def drain_post_sentiment_batch_task(self):
+    """Drains the pending-post list in chunks of SENTIMENT_BATCH_SIZE until it is empty."""
+    if redis_publisher_client is None:
+        print("Batch: Redis publisher client not initialized. Cannot drain pending posts.")
+        return
+
+    # Keyed by task id, so a redelivery of this task picks up the batch its
+    # crashed predecessor was holding
+    processing_key = f"{SENTIMENT_PROCESSING_PREFIX}:{self.request.id or uuid.uuid4()}"
+    if delivery_limit_exceeded(self.request.id):
+        # The held batch keeps killing the worker; drop it and drain new work
+        abandoned = redis_publisher_client.lrange(processing_key, 0, -1)
+        redis_publisher_client.delete(processing_key)
+        post_ids = [json.loads(raw)["post_id"] for raw in abandoned]
+        print(f"Batch: Delivered more than {SENTIMENT_TASK_MAX_DELIVERIES} times. Giving up on posts {post_ids}.")
+
+    # Cleared before popping so posts queued from here on schedule a fresh drain
+    redis_publisher_client.delete(SENTIMENT_DRAIN_SCHEDULED_KEY)
+    try:
+        while True:
+            raw_jobs, recovered = claim_sentiment_jobs(processing_key)
+            if not raw_jobs:
+                return
+            if recovered:
+                print(f"Batch: Recovered {len(raw_jobs)} posts left unfinished by an earlier delivery.")
+            succeeded = process_sentiment_batch([json.loads(raw) for raw in raw_jobs])
+            # The batch is now committed or back on the pending list
+            redis_publisher_client.delete(processing_key)
+            if not succeeded:
+                # Re-queued with a delayed retry; stop instead of hammering a failing dependency
+                return
+            if len(raw_jobs) < SENTIMENT_BATCH_SIZE and not recovered:
+                return
+    finally:
+        clear_deliveries(self.request.id)
 
 #=====================
 #ads/insights pipeline
@@ -5,6 +5,14 @@ import redis
 REDIS_BROKER_URL = os.getenv("REDIS_BROKER_URL", "redis://redis:6379/0")
 redis_client = redis.StrictRedis.from_url(REDIS_BROKER_URL, decode_responses=True)
 
+# Sentiment updates are published on one channel per user, so each backend
+# process only subscribes to (and receives) updates for the sockets it holds.
+SENTIMENT_CHANNEL_PREFIX = "sentiment_updates"
+
+def sentiment_channel_for_user(user_id):
+    """Return the Pub/Sub channel carrying sentiment updates for this user."""
+    return f"{SENTIMENT_CHANNEL_PREFIX}:{user_id}"
+
 def queue_key_for_user(user_id):
     """Return the Redis list key for this user's message queue."""
     return f"user_queue:{user_id}"
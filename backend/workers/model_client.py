@@ -0,0 +1,173 @@
+# backend/workers/model_client.py
+import importlib.util
+import os
+import random
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from silhouet_config import PERSONALITY_KEYS, PERSONALITY_KEYS_VERSION
+
+MODEL_SERVICE_URL = os.getenv("MODEL_SERVICE_URL", "http://model:8001/score")
+# "json" for the typed JSON response, "float32" for the packed little-endian
+# float32 matrix (4 bytes per score, no JSON encoding on either side).
+MODEL_RESPONSE_FORMAT = os.getenv("MODEL_RESPONSE_FORMAT", "json")
+FLOAT32_MEDIA_TYPE = "application/x-float32"
+
+# Connection pool and timeouts. Each worker process keeps one client so calls
+# reuse keep-alive connections instead of opening a TCP connection per post.
+MODEL_CONNECT_TIMEOUT = float(os.getenv("MODEL_CONNECT_TIMEOUT", "2"))
+MODEL_READ_TIMEOUT = float(os.getenv("MODEL_READ_TIMEOUT", "30"))
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", "4"))
+# HTTP/2 is only negotiated over TLS, and only when the h2 package is installed
+MODEL_HTTP2 = os.getenv("MODEL_HTTP2", "true").lower() == "true"
+
+# Retries on 5xx and connect errors, with full-jitter exponential backoff
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "2"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_SECONDS", "0.2"))
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "5"))
+
+# After this many consecutive failed calls the breaker opens and calls fail
+# immediately for MODEL_BREAKER_RESET_SECONDS, then a single trial call decides
+# whether it closes again.
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "5"))
+MODEL_BREAKER_RESET_SECONDS = float(os.getenv("MODEL_BREAKER_RESET_SECONDS", "30"))
+
+class ModelResponseError(Exception):
+    """The model service answered, but not with scores this worker can use."""
+
+class ModelUnavailableError(Exception):
+    """The circuit breaker is open; the model service is not being called."""
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self.trial_in_flight:
+                raise ModelUnavailableError(
+                    f"Model service circuit open after {self.failures} consecutive failures "
+                    f"(retry in {max(remaining, 0):.0f}s)"
+                )
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Model client: circuit opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker(MODEL_BREAKER_FAILURES, MODEL_BREAKER_RESET_SECONDS)
+
+_client: Optional[httpx.Client] = None
+_client_pid: Optional[int] = None
+
+def get_client() -> httpx.Client:
+    """
+    The pooled client for this process. Celery's prefork pool forks workers
+    after this module is imported, so the client is created lazily and
+    recreated if the pid changes; sockets are never shared across processes.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        http2 = MODEL_HTTP2 and importlib.util.find_spec("h2") is not None
+        _client = httpx.Client(
+            timeout=httpx.Timeout(MODEL_READ_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MODEL_POOL_SIZE, max_keepalive_connections=MODEL_POOL_SIZE),
+            http2=http2,
+        )
+        _client_pid = os.getpid()
+    return _client
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    delay = random.uniform(0, min(MODEL_RETRY_MAX_SECONDS, MODEL_RETRY_BASE_SECONDS * 2 ** attempt))
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(float(retry_after), MODEL_RETRY_MAX_SECONDS))
+    return delay
+
+def _check_keys_version(version: str):
+    if version != PERSONALITY_KEYS_VERSION:
+        raise ModelResponseError(
+            f"Model scores are ordered by keys version {version}, worker expects {PERSONALITY_KEYS_VERSION}. "
+            "silhouet_config.py differs between services."
+        )
+
+def scores_to_dict(scores: List[float]) -> Dict[str, float]:
+    return dict(zip(PERSONALITY_KEYS, scores))
+
+def decode_float32(response: httpx.Response) -> List[List[float]]:
+    _check_keys_version(response.headers.get("X-Personality-Keys-Version"))
+    rows, cols = (int(n) for n in response.headers["X-Score-Shape"].split(","))
+    if cols != len(PERSONALITY_KEYS) or len(response.content) != rows * cols * 4:
+        raise ModelResponseError(f"Unexpected float32 payload shape {rows}x{cols} ({len(response.content)} bytes)")
+    flat = struct.unpack(f"<{rows * cols}f", response.content)
+    return [list(flat[i * cols:(i + 1) * cols]) for i in range(rows)]
+
+def decode_json(payload: dict) -> List[List[float]]:
+    _check_keys_version(payload.get("keys_version"))
+    rows = [payload["scores"]] if "scores" in payload else [item["scores"] for item in payload["results"]]
+    for row in rows:
+        if len(row) != len(PERSONALITY_KEYS):
+            raise ModelResponseError(f"Expected {len(PERSONALITY_KEYS)} scores, got {len(row)}")
+    return rows
+
+def _send(url: str, body: dict, headers: dict) -> httpx.Response:
+    """POSTs with retries on 5xx and connect errors. Raises the last error once retries run out."""
+    client = get_client()
+    for attempt in range(MODEL_MAX_RETRIES + 1):
+        response = None
+        try:
+            response = client.post(url, json=body, headers=headers)
+            if response.status_code < 500:
+                return response
+            if attempt == MODEL_MAX_RETRIES:
+                response.raise_for_status()
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+            # Read timeouts are not retried: the model is already busy with the request
+            if attempt == MODEL_MAX_RETRIES:
+                raise
+        time.sleep(_retry_delay(attempt, response))
+
+def _post(url: str, body: dict) -> List[List[float]]:
+    headers = {"Accept": FLOAT32_MEDIA_TYPE} if MODEL_RESPONSE_FORMAT == "float32" else {}
+    breaker.before_call()
+    try:
+        response = _send(url, body, headers)
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith(FLOAT32_MEDIA_TYPE):
+        return decode_float32(response)
+    return decode_json(response.json())
+
+def score_text(text: str) -> Dict[str, float]:
+    """Scores one text and returns {personality_key: score}."""
+    return scores_to_dict(_post(MODEL_SERVICE_URL, {"text": text})[0])
+
+def score_texts(texts: List[str]) -> List[Dict[str, float]]:
+    """Scores many texts in one request to the model's /score/batch endpoint."""
+    rows = _post(f"{MODEL_SERVICE_URL.rstrip('/')}/batch", {"texts": texts})
+    return [scores_to_dict(row) for row in rows]
@@ -0,0 +1,129 @@
+# model/batching.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+class BatcherSaturated(Exception):
+    """Raised when the pending queue is full and a request cannot be accepted."""
+
+class MicroBatcher:
+    """
+    Merges concurrent scoring requests into shared batches.
+
+    Callers `submit()` a single item and await its result. A background task
+    collects items until either `max_batch_size` is reached or `max_wait_ms`
+    has elapsed since the first item of the batch arrived, then runs
+    `batch_fn` once for the whole batch on a bounded thread pool so the event
+    loop stays free. At most `max_queue_depth` items may be pending; beyond
+    that `submit()` raises BatcherSaturated instead of queuing.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 workers: int = 1, max_queue_depth: int = 256):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.workers = max(1, workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.queue: Optional[asyncio.Queue] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight = 0
+        self._batches: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue_depth)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+            self._slots = asyncio.Semaphore(self.workers)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _enqueue(self, item: Any) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise BatcherSaturated(f"Inference queue is full ({self.max_queue_depth} pending)") from None
+        return future
+
+    async def submit(self, item: Any) -> Any:
+        return await self._enqueue(item)
+
+    async def submit_many(self, items: List[Any]) -> List[Any]:
+        # All-or-nothing admission so a rejected batch never leaves stragglers queued
+        if self.pending + len(items) > self.max_queue_depth:
+            raise BatcherSaturated(f"Inference queue cannot take {len(items)} more items")
+        futures = [self._enqueue(item) for item in items]
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> list:
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without waiting
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batch(self, batch: list):
+        items = [item for item, _ in batch]
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self._inflight -= len(batch)
+            self._slots.release()
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _run(self):
+        while True:
+            # Only pull the next batch once an executor slot is free, so items
+            # back up in the bounded queue rather than in the thread pool
+            await self._slots.acquire()
+            batch = await self._collect()
+            # Requests whose client already went away don't need scoring
+            batch = [(item, fut) for item, fut in batch if not fut.done()]
+            if not batch:
+                self._slots.release()
+                continue
+            self._inflight += len(batch)
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
@@ -0,0 +1,89 @@
+# model/bench/bench_segmentation.py
+"""
+Compares sentence segmentation modes used by the scoring path.
+
+For every mode in segmentation.SEGMENTER_MODES it reports per-document latency
+and how closely its sentence boundaries agree with the full-parser mode on a
+sample corpus. Run from the model directory:
+
+    python bench/bench_segmentation.py [--corpus bench/sample_corpus.json] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+model_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, model_dir)
+
+from segmentation import SEGMENTER_MODES, load_segmenter
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "sample_corpus.json")
+
+def boundaries(text, sentences):
+    """Character offsets where each sentence ends, located in the original text."""
+    ends, cursor = set(), 0
+    for sent in sentences:
+        start = text.find(sent, cursor)
+        if start < 0:
+            continue
+        cursor = start + len(sent)
+        ends.add(cursor)
+    return ends
+
+def boundary_f1(reference, candidate):
+    if not reference and not candidate:
+        return 1.0
+    overlap = len(reference & candidate)
+    precision = overlap / len(candidate) if candidate else 0.0
+    recall = overlap / len(reference) if reference else 0.0
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+def time_mode(split, samples, repeat):
+    # Warm-up so lazy model initialisation is not counted
+    for text in samples:
+        split(text)
+    per_doc_ms = []
+    for _ in range(repeat):
+        for text in samples:
+            start = time.perf_counter()
+            split(text)
+            per_doc_ms.append((time.perf_counter() - start) * 1000)
+    return per_doc_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentence segmentation modes")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        samples = json.load(f)["samples"]
+
+    splitters = {mode: load_segmenter(mode) for mode in SEGMENTER_MODES}
+    reference = {text: splitters["parser"](text) for text in samples}
+
+    print(f"Corpus: {len(samples)} documents, {args.repeat} passes\n")
+    print(f"{'mode':<12} {'mean ms':>8} {'p95 ms':>8} {'docs/s':>9} {'speedup':>8} {'exact':>7} {'bndry F1':>9}")
+
+    baseline_mean = None
+    for mode, split in splitters.items():
+        per_doc_ms = time_mode(split, samples, args.repeat)
+        mean_ms = statistics.mean(per_doc_ms)
+        p95_ms = statistics.quantiles(per_doc_ms, n=20)[-1]
+        if baseline_mean is None:
+            baseline_mean = mean_ms
+
+        exact, f1s = 0, []
+        for text in samples:
+            ref_sents, cand_sents = reference[text], split(text)
+            exact += ref_sents == cand_sents
+            f1s.append(boundary_f1(boundaries(text, ref_sents), boundaries(text, cand_sents)))
+
+        print(f"{mode:<12} {mean_ms:>8.2f} {p95_ms:>8.2f} {1000 / mean_ms:>9.0f} {baseline_mean / mean_ms:>7.1f}x "
+              f"{exact / len(samples):>6.0%} {statistics.mean(f1s):>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# model/bench/bench_throughput.py
+"""
+Measures how /score throughput scales with the number of preforked workers.
+
+For each worker count it starts `serve.py` with MODEL_WORKERS=N, drives it with
+concurrent /score requests built from the sample corpus for a fixed duration,
+and reports posts/second, latency percentiles, scaling efficiency relative to
+one worker, and total proportional memory (PSS) of the process tree, which
+shows how much of the model the workers share. Run from the model directory:
+
+    python bench/bench_throughput.py --workers 1 2 4 [--concurrency 32] [--duration 30]
+
+The embedding cache is disabled for the run so repeated corpus sentences do
+not inflate the numbers. PSS is read from /proc and is only reported on Linux.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+model_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "sample_corpus.json")
+
+def process_tree(pid):
+    children_path = f"/proc/{pid}/task/{pid}/children"
+    pids = [pid]
+    try:
+        with open(children_path) as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+def total_pss_mb(pid):
+    total_kb = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            return None
+    return total_kb / 1024
+
+async def wait_until_healthy(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health", timeout=2)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(1)
+    raise RuntimeError(f"Model service at {base_url} did not become healthy within {timeout}s")
+
+async def drive_load(base_url, samples, concurrency, duration, warmup):
+    texts = itertools.cycle(samples)
+    latencies, rejected = [], 0
+    stop_at = time.monotonic() + warmup + duration
+    measure_from = time.monotonic() + warmup
+
+    async def client_loop(client):
+        nonlocal rejected
+        while time.monotonic() < stop_at:
+            start = time.monotonic()
+            response = await client.post(f"{base_url}/score", json={"text": next(texts)}, timeout=60)
+            if response.status_code == 503:
+                rejected += 1
+                await asyncio.sleep(0.05)
+                continue
+            response.raise_for_status()
+            if start >= measure_from:
+                latencies.append(time.monotonic() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return latencies, rejected
+
+def run_for_workers(workers, args, samples):
+    port = args.port
+    env = dict(os.environ, MODEL_WORKERS=str(workers), MODEL_PORT=str(port), MODEL_EMBEDDING_CACHE_MB="0")
+    server = subprocess.Popen([sys.executable, "serve.py"], cwd=model_dir, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_until_healthy(base_url, args.startup_timeout))
+        pss = total_pss_mb(server.pid)
+        latencies, rejected = asyncio.run(drive_load(base_url, samples, args.concurrency, args.duration, args.warmup))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    return {
+        "workers": workers,
+        "posts_per_sec": len(latencies) / args.duration,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else None,
+        "rejected": rejected,
+        "pss_mb": pss,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /score throughput against worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds per worker count")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        samples = json.load(f)["samples"]
+
+    print(f"CPU cores: {os.cpu_count()}, concurrency: {args.concurrency}, {args.duration:.0f}s per run\n")
+    print(f"{'workers':>7} {'posts/s':>9} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8} {'503s':>6} {'PSS MB':>8}")
+    results = []
+    for workers in args.workers:
+        row = run_for_workers(workers, args, samples)
+        results.append(row)
+        base = results[0]["posts_per_sec"] / results[0]["workers"]
+        efficiency = row["posts_per_sec"] / (base * workers) if base else 0.0
+        row["scaling_efficiency"] = efficiency
+        fmt = lambda v: f"{v:.1f}" if v is not None else "n/a"
+        print(f"{workers:>7} {row['posts_per_sec']:>9.1f} {efficiency:>7.0%} {fmt(row['p50_ms']):>8} "
+              f"{fmt(row['p95_ms']):>8} {row['rejected']:>6} {fmt(row['pss_mb']):>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# model/bench/check_scoring_parity.py
+"""
+Checks that TraitScorer's matrix path gives the same scores as the original
+per-sentence, per-key cos_sim loop it replaced.
+
+Both paths score the sample corpus from the same sentence embeddings, and the
+per-key averages (before softmax) and the final softmax scores must agree
+within --atol. Exits non-zero on a mismatch. Run from the model directory:
+
+    python bench/check_scoring_parity.py [--corpus bench/sample_corpus.json] [--random-embeddings]
+
+--random-embeddings replaces the encoder with fixed pseudo-random vectors and
+splits sentences on punctuation, so the math can be checked without the model
+weights or spaCy.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+model_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, model_dir)
+
+import numpy as np
+from silhouet_config import PERSONALITY_KEYS, PERSONALITY_LABEL_MAP, SENSITIVITY_MASKS
+
+from scoring import (
+    RELEVANCE_HARD_CUTOFF, RELEVANCE_SOFT_START, SENSITIVITY_FACTORS,
+    TraitScorer, build_reference_matrix, softmax_scale,
+)
+
+MODEL_NAME = "all-mpnet-base-v2"
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "sample_corpus.json")
+RANDOM_DIM = 768
+
+def random_encode(texts):
+    """Deterministic stand-in for the encoder: one seeded random vector per text."""
+    rows = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        rows.append(np.random.default_rng(seed).standard_normal(RANDOM_DIM))
+    return np.vstack(rows).astype(np.float32)
+
+def cos_sim(a, b):
+    """Same as sentence_transformers.util.cos_sim: (len(a) x len(b)) cosine similarities."""
+    a = np.atleast_2d(a).astype(np.float64)
+    b = np.atleast_2d(b).astype(np.float64)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return a @ b.T
+
+def reference_scores(sentences, embeddings, encode):
+    """The original per-sentence loop from serve.py, kept as the reference."""
+    key_vectors, mask_vectors = {}, {}
+    for key in PERSONALITY_KEYS:
+        key_vectors[key] = {
+            "positive": np.mean(encode([PERSONALITY_LABEL_MAP[key][0]]), axis=0),
+            "negative": np.mean(encode([PERSONALITY_LABEL_MAP[key][1]]), axis=0),
+        }
+        if SENSITIVITY_MASKS.get(key):
+            mask_vectors[key] = encode(SENSITIVITY_MASKS[key])
+
+    aggregated_scores = {key: 0.0 for key in PERSONALITY_KEYS}
+    total_weights = {key: 0.0 for key in PERSONALITY_KEYS}
+    for sent, sent_embedding in zip(sentences, embeddings):
+        sent_len = len(sent.split())
+        for key in PERSONALITY_KEYS:
+            if key in mask_vectors:
+                relevance = float(max(cos_sim(sent_embedding, mask_vectors[key]).flatten()))
+            else:
+                relevance = 1.0
+
+            if relevance < RELEVANCE_HARD_CUTOFF:
+                continue
+            elif relevance < RELEVANCE_SOFT_START:
+                weight = (relevance - RELEVANCE_HARD_CUTOFF) / (RELEVANCE_SOFT_START - RELEVANCE_HARD_CUTOFF)
+            else:
+                weight = 1.0
+
+            pos_similarity = cos_sim(sent_embedding, key_vectors[key]["positive"]).item()
+            neg_similarity = cos_sim(sent_embedding, key_vectors[key]["negative"]).item()
+            adjusted_score = (pos_similarity - neg_similarity) * weight * SENSITIVITY_FACTORS.get(key, 1.0)
+
+            aggregated_scores[key] += adjusted_score * sent_len
+            total_weights[key] += sent_len
+
+    return np.array([
+        aggregated_scores[key] / total_weights[key] if total_weights[key] > 0 else 0.0
+        for key in PERSONALITY_KEYS
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the matrix scoring path against the per-key loop")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--random-embeddings", action="store_true", help="Use seeded random vectors instead of the encoder")
+    parser.add_argument("--atol", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        samples = json.load(f)["samples"]
+
+    if args.random_embeddings:
+        encode = random_encode
+        split = lambda text: [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+    else:
+        from encoders import load_encoder
+        from segmentation import load_segmenter
+        encoder = load_encoder(MODEL_NAME)
+        encode = lambda texts: encoder.encode(texts, convert_to_numpy=True)
+        split = load_segmenter(os.getenv("MODEL_SEGMENTER", "parser"))
+
+    scorer = TraitScorer(build_reference_matrix(encode))
+    worst_raw, worst_final, failures = 0.0, 0.0, 0
+    for i, text in enumerate(samples):
+        sentences = split(text)
+        if not sentences:
+            continue
+        embeddings = encode(sentences)
+        sent_lens = np.array([len(sent.split()) for sent in sentences])
+
+        expected = reference_scores(sentences, embeddings, encode)
+        actual = scorer.score_embeddings(embeddings, sent_lens)
+        raw_diff = float(np.abs(actual - expected).max())
+        final_diff = float(np.abs(softmax_scale(actual) - softmax_scale(expected)).max())
+        worst_raw, worst_final = max(worst_raw, raw_diff), max(worst_final, final_diff)
+        if not (np.allclose(actual, expected, atol=args.atol) and np.allclose(softmax_scale(actual), softmax_scale(expected), atol=args.atol)):
+            failures += 1
+            print(f"Mismatch in sample {i}: max |d| {raw_diff:.2e} before softmax, {final_diff:.2e} after")
+
+    print(f"{len(samples)} documents checked, max |d| {worst_raw:.2e} before softmax, {worst_final:.2e} after (atol={args.atol})")
+    if failures:
+        print(f"FAILED: {failures} documents differ")
+        sys.exit(1)
+    print("OK: matrix path matches the per-key loop")
+
+if __name__ == "__main__":
+    main()
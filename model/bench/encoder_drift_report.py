@@ -0,0 +1,98 @@
+# model/bench/encoder_drift_report.py
+"""
+Accuracy-drift report for the encoder backends in encoders.ENCODER_BACKENDS.
+
+Scores a fixed corpus with every backend and compares embeddings and final
+trait scores against the PyTorch baseline. Run from the model directory:
+
+    python bench/encoder_drift_report.py [--corpus bench/sample_corpus.json] [--backends torch onnx onnx-int8] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+model_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, model_dir)
+
+import numpy as np
+from silhouet_config import PERSONALITY_KEYS
+
+from encoders import ENCODER_BACKENDS, encoder_id, load_encoder
+from scoring import TraitScorer, load_or_build_reference_matrix
+from segmentation import load_segmenter
+
+MODEL_NAME = "all-mpnet-base-v2"
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "sample_corpus.json")
+TOP_K = 3
+
+def run_backend(backend, doc_sentences, repeat):
+    encoder = load_encoder(MODEL_NAME, backend)
+    encode = lambda texts: encoder.encode(texts, convert_to_numpy=True)
+    scorer = TraitScorer(load_or_build_reference_matrix(encoder_id(MODEL_NAME, backend), encode))
+
+    sentences = [sent for doc in doc_sentences for sent in doc]
+    encode(sentences[:8])  # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        embeddings = encode(sentences)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "embeddings": embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True),
+        "scores": scorer.score_documents(doc_sentences, embeddings).astype(np.float64),
+        "sentences_per_sec": len(sentences) / statistics.median(timings),
+    }
+
+def compare(baseline, candidate):
+    score_diff = np.abs(candidate["scores"] - baseline["scores"])
+    embedding_cos = np.sum(candidate["embeddings"] * baseline["embeddings"], axis=1)
+    base_top = np.argsort(-baseline["scores"], axis=1)[:, :TOP_K]
+    cand_top = np.argsort(-candidate["scores"], axis=1)[:, :TOP_K]
+    top_overlap = [len(set(b) & set(c)) / TOP_K for b, c in zip(base_top, cand_top)]
+    worst_trait = PERSONALITY_KEYS[int(np.argmax(score_diff.max(axis=0)))]
+    return {
+        "embedding_cosine_mean": float(embedding_cos.mean()),
+        "embedding_cosine_min": float(embedding_cos.min()),
+        "score_abs_diff_mean": float(score_diff.mean()),
+        "score_abs_diff_max": float(score_diff.max()),
+        "worst_trait": worst_trait,
+        f"top{TOP_K}_overlap": float(np.mean(top_overlap)),
+        "speedup": candidate["sentences_per_sec"] / baseline["sentences_per_sec"],
+        "sentences_per_sec": candidate["sentences_per_sec"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare encoder backends against the PyTorch baseline")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument("--segmenter", default=os.getenv("MODEL_SEGMENTER", "parser"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        samples = json.load(f)["samples"]
+    split = load_segmenter(args.segmenter)
+    doc_sentences = [split(text) for text in samples]
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results = {backend: run_backend(backend, doc_sentences, args.repeat) for backend in backends}
+
+    report = {backend: compare(results["torch"], results[backend]) for backend in backends}
+    print(f"Corpus: {len(samples)} documents, {sum(map(len, doc_sentences))} sentences (segmenter={args.segmenter})\n")
+    print(f"{'backend':<10} {'sent/s':>8} {'speedup':>8} {'emb cos':>8} {'min cos':>8} {'mean |d|':>9} {'max |d|':>8} {f'top{TOP_K}':>6}  worst trait")
+    for backend, row in report.items():
+        print(f"{backend:<10} {row['sentences_per_sec']:>8.1f} {row['speedup']:>7.2f}x {row['embedding_cosine_mean']:>8.4f} "
+              f"{row['embedding_cosine_min']:>8.4f} {row['score_abs_diff_mean']:>9.5f} {row['score_abs_diff_max']:>8.5f} "
+              f"{row[f'top{TOP_K}_overlap']:>6.0%}  {row['worst_trait']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# model/embedding_cache.py
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Rough per-entry bookkeeping cost (key bytes, OrderedDict node, ndarray header)
+ENTRY_OVERHEAD_BYTES = 160
+
+def normalize_sentence(sentence: str) -> str:
+    """Canonical form used both as the cache key and as the text sent to the encoder."""
+    return " ".join(unicodedata.normalize("NFKC", sentence).split())
+
+def sentence_key(model_name: str, normalized: str) -> str:
+    return hashlib.blake2b(f"{model_name}\x00{normalized}".encode("utf-8"), digest_size=16).hexdigest()
+
+class EmbeddingCache:
+    """
+    In-process LRU cache of sentence embeddings bounded by a memory budget,
+    optionally backed by Redis so every model replica shares the same entries.
+
+    Entries are keyed by a hash of the model name and the normalised sentence
+    and stored as float32 vectors. The in-process layer is always consulted
+    first; Redis misses and errors fall through to the encoder.
+    """
+
+    def __init__(self, model_name: str, max_bytes: int, redis_url: Optional[str] = None, redis_ttl_seconds: int = 7 * 24 * 3600):
+        self.model_name = model_name
+        self.max_bytes = max(0, max_bytes)
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.evictions = 0
+
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url, decode_responses=False, socket_timeout=0.5)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.redis is not None
+
+    def _redis_key(self, key: str) -> str:
+        return f"emb:{key}"
+
+    def _store_local(self, key: str, vector: np.ndarray):
+        if self.max_bytes <= 0:
+            return
+        size = vector.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = vector
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+                self.evictions += 1
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+
+        remote = [key for key in keys if key not in found]
+        redis_hits = redis_errors = 0
+        if remote and self.redis is not None:
+            try:
+                values = self.redis.mget([self._redis_key(key) for key in remote])
+            except Exception as e:
+                redis_errors = 1
+                print(f"[EmbeddingCache] Redis lookup failed: {e}")
+                values = [None] * len(remote)
+            for key, raw in zip(remote, values):
+                if raw:
+                    vector = np.frombuffer(raw, dtype=np.float32)
+                    found[key] = vector
+                    self._store_local(key, vector)
+                    redis_hits += 1
+
+        # get_many runs on several inference threads; counters are only updated under the lock
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            self.redis_hits += redis_hits
+            self.redis_errors += redis_errors
+        return found
+
+    def put_many(self, entries: Dict[str, np.ndarray]):
+        if not entries:
+            return
+        entries = {key: np.ascontiguousarray(vector, dtype=np.float32) for key, vector in entries.items()}
+        for key, vector in entries.items():
+            self._store_local(key, vector)
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, vector in entries.items():
+                    pipe.set(self._redis_key(key), vector.tobytes(), ex=self.redis_ttl_seconds)
+                pipe.execute()
+            except Exception as e:
+                with self._lock:
+                    self.redis_errors += 1
+                print(f"[EmbeddingCache] Redis store failed: {e}")
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            entries, used, evictions = len(self._entries), self._bytes, self.evictions
+            hits, misses, redis_hits, redis_errors = self.hits, self.misses, self.redis_hits, self.redis_errors
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "redis_enabled": self.redis is not None,
+            "redis_hits": redis_hits,
+            "redis_errors": redis_errors,
+            "evictions": evictions,
+        }
@@ -0,0 +1,54 @@
+# model/encoders.py
+import glob
+import os
+
+from sentence_transformers import SentenceTransformer
+
+# Supported MODEL_ENCODER_BACKEND values:
+#   torch      - the PyTorch SentenceTransformer (original behaviour)
+#   onnx       - the same weights exported to ONNX and run with ONNX Runtime
+#   onnx-int8  - the ONNX export with dynamic int8 quantisation of the linear layers
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+EXPORT_DIR = os.getenv("MODEL_ENCODER_EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts", "encoders"))
+# One of sentence-transformers' quantisation presets: arm64, avx2, avx512, avx512_vnni
+ONNX_QUANT_CONFIG = os.getenv("MODEL_ONNX_QUANT_CONFIG", "avx2")
+
+def encoder_id(model_name: str, backend: str) -> str:
+    """Identifier used to keep artifacts and cached embeddings separate per backend."""
+    if backend == "torch":
+        return model_name
+    if backend == "onnx-int8":
+        return f"{model_name}-onnx-int8-{ONNX_QUANT_CONFIG}"
+    return f"{model_name}-{backend}"
+
+def _load_quantized(model_name: str) -> SentenceTransformer:
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    export_path = os.path.join(EXPORT_DIR, model_name)
+    pattern = os.path.join(export_path, "**", f"*qint8*{ONNX_QUANT_CONFIG}*.onnx")
+    existing = glob.glob(pattern, recursive=True)
+    if not existing:
+        print(f"[Encoder] Exporting int8 ({ONNX_QUANT_CONFIG}) ONNX model to {export_path}...")
+        onnx_model = SentenceTransformer(model_name, backend="onnx")
+        onnx_model.save(export_path)
+        export_dynamic_quantized_onnx_model(onnx_model, ONNX_QUANT_CONFIG, export_path)
+        existing = glob.glob(pattern, recursive=True)
+        if not existing:
+            raise RuntimeError(f"Quantised ONNX export did not produce a file matching {pattern}")
+
+    file_name = os.path.relpath(existing[0], export_path)
+    return SentenceTransformer(export_path, backend="onnx", model_kwargs={"file_name": file_name})
+
+def load_encoder(model_name: str, backend: str = "torch") -> SentenceTransformer:
+    """
+    Loads the sentence encoder for the requested backend. All backends expose
+    the same `encode()` interface, so the scoring path does not change.
+    """
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    if backend == "onnx-int8":
+        return _load_quantized(model_name)
+    raise ValueError(f"Unknown encoder backend '{backend}'. Expected one of: {', '.join(ENCODER_BACKENDS)}")
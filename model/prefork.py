@@ -0,0 +1,50 @@
+# model/prefork.py
+import gc
+import os
+
+from gunicorn.app.base import BaseApplication
+
+def default_threads_per_worker(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+class PreforkServer(BaseApplication):
+    """
+    Serves an already-imported ASGI app from N forked uvicorn workers.
+
+    The master process has loaded the encoder, spaCy pipeline and reference
+    matrix before `run()` is called, so forked workers share those pages
+    copy-on-write instead of each loading its own copy. `gc.freeze()` moves
+    everything allocated so far out of the collector's reach, so collections in
+    the workers do not touch (and un-share) the inherited objects.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int, threads_per_worker: int, timeout: int = 120):
+        self.application = app
+        self.threads_per_worker = threads_per_worker
+        self.options = {
+            "bind": f"{host}:{port}",
+            "workers": workers,
+            "worker_class": "uvicorn.workers.UvicornWorker",
+            "timeout": timeout,
+            "preload_app": True,
+            "pre_fork": self.pre_fork,
+            "post_fork": self.post_fork,
+        }
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+    @staticmethod
+    def pre_fork(server, worker):
+        gc.freeze()
+
+    def post_fork(self, server, worker):
+        # Each worker gets its own slice of the cores for intra-op parallelism
+        import torch
+        torch.set_num_threads(self.threads_per_worker)
+        server.log.info(f"Worker {worker.pid} using {self.threads_per_worker} torch threads")
@@ -0,0 +1,204 @@
+# model/scoring.py
+import hashlib
+import json
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+from silhouet_config import PERSONALITY_KEYS, PERSONALITY_LABEL_MAP, SENSITIVITY_MASKS, SCALE_FACTOR
+
+# Config
+RELEVANCE_SOFT_START = 0.2
+RELEVANCE_HARD_CUTOFF = 0.05
+SENSITIVITY_FACTORS: Dict[str, float] = {
+    "relationship_satisfaction": 0.7,
+    "resentment": 0.9,
+    # default 1.0 for others
+}
+
+# --- Stacked scoring matrices ---
+# All reference vectors are L2-normalised and stacked into one matrix so a post
+# is scored with a single (sentences x refs) matrix multiply. Row layout:
+#   [0, K)          positive pole per key
+#   [K, 2K)         negative pole per key
+#   [2K, 2K + M)    sensitivity mask phrases, grouped by key in PERSONALITY_KEYS order
+NUM_KEYS = len(PERSONALITY_KEYS)
+
+# Encoding every label example and mask phrase takes tens of seconds, so the
+# stacked matrix is compiled once into ARTIFACT_DIR and memory-mapped on later
+# starts. The file name carries a fingerprint of the encoder and the config
+# content it was built from, so editing silhouet_config.py triggers a rebuild.
+ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts"))
+ARTIFACT_FORMAT_VERSION = 1
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+def config_fingerprint(encoder_id: str) -> str:
+    """Hash of everything the reference matrix depends on."""
+    payload = {
+        "version": ARTIFACT_FORMAT_VERSION,
+        "model": encoder_id,
+        "keys": PERSONALITY_KEYS,
+        "labels": [PERSONALITY_LABEL_MAP[k][:2] for k in PERSONALITY_KEYS],
+        "masks": [SENSITIVITY_MASKS.get(k) or [] for k in PERSONALITY_KEYS],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def mask_layout():
+    """Indices of keys that have mask phrases and the offset of each key's block of mask rows."""
+    masked_keys = [i for i, k in enumerate(PERSONALITY_KEYS) if SENSITIVITY_MASKS.get(k)]
+    counts = [len(SENSITIVITY_MASKS[PERSONALITY_KEYS[i]]) for i in masked_keys]
+    mask_offsets = np.cumsum([0] + counts[:-1]).astype(np.int64)
+    return np.array(masked_keys, dtype=np.int64), mask_offsets
+
+def build_reference_matrix(encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    """Encodes every label example and mask phrase into the stacked reference matrix."""
+    pos_rows, neg_rows, mask_blocks = [], [], []
+    for key in PERSONALITY_KEYS:
+        # Get all positive and negative examples for the current key
+        pos_examples = [PERSONALITY_LABEL_MAP[key][0]]  # Or loop through all positive examples
+        neg_examples = [PERSONALITY_LABEL_MAP[key][1]]  # Or loop through all negative examples
+
+        # Mean embedding of each pole
+        pos_rows.append(np.mean(encode(pos_examples), axis=0))
+        neg_rows.append(np.mean(encode(neg_examples), axis=0))
+
+        mask_phrases = SENSITIVITY_MASKS.get(key)
+        if mask_phrases:
+            mask_blocks.append(encode(mask_phrases))
+
+    blocks = [np.vstack(pos_rows), np.vstack(neg_rows)] + mask_blocks
+    return _normalize_rows(np.vstack(blocks).astype(np.float32))
+
+def load_or_build_reference_matrix(encoder_id: str, encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    path = os.path.join(ARTIFACT_DIR, f"reference_{encoder_id}_{config_fingerprint(encoder_id)}.npy")
+    if os.path.exists(path):
+        try:
+            matrix = np.load(path, mmap_mode="r")
+            print(f"[Startup] Loaded reference matrix {matrix.shape} from {path}")
+            return matrix
+        except Exception as e:
+            print(f"[Startup] Could not load {path}, rebuilding: {e}")
+
+    print("[Startup] Encoding personality key and mask reference vectors...")
+    matrix = build_reference_matrix(encode)
+    try:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, path)
+        print(f"[Startup] Saved reference matrix to {path}")
+    except OSError as e:
+        print(f"[Startup] Could not persist reference matrix: {e}")
+    return matrix
+
+def softmax_scale(final_scores: np.ndarray) -> np.ndarray:
+    exp_scores = np.exp(final_scores - np.max(final_scores))
+    return SCALE_FACTOR * exp_scores / exp_scores.sum()
+
+class TraitScorer:
+    """Scores sentence embeddings against a stacked reference matrix."""
+
+    def __init__(self, reference_matrix: np.ndarray):
+        self.reference_matrix = reference_matrix
+        self.masked_key_index, self.mask_offsets = mask_layout()
+        self.sensitivity = np.array([SENSITIVITY_FACTORS.get(k, 1.0) for k in PERSONALITY_KEYS], dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self.reference_matrix.shape[1]
+
+    def _components(self, embeddings: np.ndarray):
+        """Per-sentence, per-key similarities, relevance and weights (N x K arrays)."""
+        sims = _normalize_rows(embeddings.astype(np.float32)) @ self.reference_matrix.T
+        pos_sim = sims[:, :NUM_KEYS]
+        neg_sim = sims[:, NUM_KEYS:2 * NUM_KEYS]
+
+        # Relevance is the best match against a key's mask phrases, or 1.0 for unmasked keys
+        relevance = np.ones_like(pos_sim)
+        if len(self.masked_key_index):
+            mask_sims = sims[:, 2 * NUM_KEYS:]
+            relevance[:, self.masked_key_index] = np.maximum.reduceat(mask_sims, self.mask_offsets, axis=1)
+
+        weight = np.where(
+            relevance < RELEVANCE_SOFT_START,
+            (relevance - RELEVANCE_HARD_CUTOFF) / (RELEVANCE_SOFT_START - RELEVANCE_HARD_CUTOFF),
+            1.0,
+        )
+        included = relevance >= RELEVANCE_HARD_CUTOFF
+        return pos_sim, neg_sim, relevance, weight, included
+
+    def score_embeddings(self, embeddings: np.ndarray, sent_lens: np.ndarray) -> np.ndarray:
+        """
+        Scores N sentence embeddings against every personality key at once.
+        Mirrors the per-key relevance / weight / pos-neg math exactly and returns
+        the length-weighted per-key averages (before softmax) in PERSONALITY_KEYS order.
+        """
+        pos_sim, neg_sim, relevance, weight, included = self._components(embeddings)
+        adjusted = (pos_sim - neg_sim) * weight * self.sensitivity
+
+        lens = sent_lens.astype(np.float64)[:, None]
+        aggregated = np.where(included, adjusted * lens, 0.0).sum(axis=0)
+        total_weights = np.where(included, lens, 0.0).sum(axis=0)
+        return np.divide(aggregated, total_weights, out=np.zeros(NUM_KEYS), where=total_weights > 0)
+
+    def explain(self, sentences: List[str], embeddings: np.ndarray) -> Dict[str, object]:
+        """
+        Per-sentence, per-key breakdown of how a document's scores were formed:
+        mask relevance, soft weight, pole similarities and adjusted score.
+        Keys below the relevance hard cutoff are reported with included=False.
+        """
+        sent_lens = np.array([len(sent.split()) for sent in sentences])
+        pos_sim, neg_sim, relevance, weight, included = self._components(embeddings)
+        raw = pos_sim - neg_sim
+        adjusted = raw * weight * self.sensitivity
+
+        breakdown = []
+        for i, sent in enumerate(sentences):
+            breakdown.append({
+                "text": sent,
+                "length": int(sent_lens[i]),
+                "keys": {
+                    key: {
+                        "relevance": round(float(relevance[i, j]), 4),
+                        "weight": round(float(weight[i, j]), 4) if included[i, j] else 0.0,
+                        "pos_sim": round(float(pos_sim[i, j]), 4),
+                        "neg_sim": round(float(neg_sim[i, j]), 4),
+                        "raw": round(float(raw[i, j]), 4),
+                        "sensitivity": float(self.sensitivity[j]),
+                        "adjusted": round(float(adjusted[i, j]), 4) if included[i, j] else 0.0,
+                        "included": bool(included[i, j]),
+                    }
+                    for j, key in enumerate(PERSONALITY_KEYS)
+                },
+            })
+        pre_softmax = self.score_embeddings(embeddings, sent_lens)
+        return {
+            "sentences": breakdown,
+            "pre_softmax": dict(zip(PERSONALITY_KEYS, np.round(pre_softmax, 6).tolist())),
+        }
+
+    def score_documents(self, doc_sentences: List[List[str]], embeddings: np.ndarray) -> np.ndarray:
+        """
+        Scores documents whose sentences were encoded together. `embeddings`
+        holds one row per sentence, in the order of the flattened `doc_sentences`.
+        Returns a (documents x keys) float32 matrix in PERSONALITY_KEYS order;
+        documents without sentences score 0.0 for every key.
+        """
+        results = np.zeros((len(doc_sentences), NUM_KEYS), dtype=np.float32)
+        offset = 0
+        for i, sentences in enumerate(doc_sentences):
+            if not sentences:
+                continue
+            doc_embeddings = embeddings[offset:offset + len(sentences)]
+            offset += len(sentences)
+            sent_lens = np.array([len(sent.split()) for sent in sentences])
+
+            final_scores = self.score_embeddings(doc_embeddings, sent_lens)
+
+            # Softmax normalization
+            results[i] = softmax_scale(final_scores)
+        return results
@@ -0,0 +1,36 @@
+# model/segmentation.py
+from typing import Callable, List
+
+import spacy
+
+SPACY_MODEL = "en_core_web_sm"
+
+# Supported MODEL_SEGMENTER values:
+#   parser       - full en_core_web_sm pipeline, sentences from the dependency parse (original behaviour)
+#   senter       - en_core_web_sm with only its statistical sentence recogniser enabled
+#   sentencizer  - blank English tokenizer plus spaCy's rule-based punctuation sentencizer
+SEGMENTER_MODES = ("parser", "senter", "sentencizer")
+
+def load_pipeline(mode: str):
+    if mode == "parser":
+        # NER and lemmas never influence doc.sents, so skip them even in parser mode
+        return spacy.load(SPACY_MODEL, exclude=["ner", "lemmatizer"])
+    if mode == "senter":
+        nlp = spacy.load(SPACY_MODEL, exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner"])
+        nlp.enable_pipe("senter")
+        return nlp
+    if mode == "sentencizer":
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        return nlp
+    raise ValueError(f"Unknown segmenter mode '{mode}'. Expected one of: {', '.join(SEGMENTER_MODES)}")
+
+def load_segmenter(mode: str) -> Callable[[str], List[str]]:
+    """Returns a function that splits a text into stripped, non-empty sentences."""
+    nlp = load_pipeline(mode)
+
+    def split(text: str) -> List[str]:
+        doc = nlp(text)
+        return [sent.text.strip() for sent in doc.sents if sent.text.strip()]
+
+    return split
@@ -1,148 +1,274 @@
 # model/serve.py
 import json, uvicorn, os
-from fastapi import FastAPI, HTTPException, Request
+import logging
+import random
+import time
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from pydantic import BaseModel, Field
-from sentence_transformers import SentenceTransformer, util
 from silhouet_config import *
-from torch import mean as torchmean
-import re
-from typing import Dict
+from typing import Any, Dict, List, NamedTuple, Optional
 import numpy as np
-import spacy
 
-app = FastAPI()
-class ScoreRequest(BaseModel):
-    text: str
+from batching import MicroBatcher, BatcherSaturated
+from embedding_cache import EmbeddingCache, normalize_sentence, sentence_key
+from encoders import encoder_id, load_encoder
+from scoring import TraitScorer, load_or_build_reference_matrix
+from segmentation import load_segmenter
 
+# --- Logging ---
+# Scoring is quiet by default. MODEL_LOG_LEVEL=DEBUG adds per-batch timings, and
+# MODEL_DEBUG_SAMPLE_RATE logs the full score breakdown for that fraction of
+# documents at INFO. Callers can also request the breakdown with `debug: true`.
+logging.basicConfig(level=os.getenv("MODEL_LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("silhouet.model")
+DEBUG_SAMPLE_RATE = float(os.getenv("MODEL_DEBUG_SAMPLE_RATE", 0))
 
 # --- Load embedding model ---
-model = SentenceTransformer("all-mpnet-base-v2")
-nlp = spacy.load("en_core_web_sm")
-
-key_vectors = {}
-mask_vectors = {}
-
-# Config
-RELEVANCE_SOFT_START = 0.2
-RELEVANCE_HARD_CUTOFF = 0.05
-SENSITIVITY_FACTORS: Dict[str, float] = {
-    "relationship_satisfaction": 0.7,
-    "resentment": 0.9,
-    # default 1.0 for others
-}
-
-for key in PERSONALITY_KEYS:
-    # Get all positive and negative examples for the current key
-    pos_examples = [PERSONALITY_LABEL_MAP[key][0]]  # Or loop through all positive examples
-    neg_examples = [PERSONALITY_LABEL_MAP[key][1]]  # Or loop through all negative examples
-
-    # Encode all examples for a trait
-    pos_embeddings = model.encode(pos_examples, convert_to_tensor=True)
-    neg_embeddings = model.encode(neg_examples, convert_to_tensor=True)
-
-    # Calculate the mean embedding for each
-    pos_vector = torchmean(pos_embeddings, dim=0, keepdim=True)
-    neg_vector = torchmean(neg_embeddings, dim=0, keepdim=True)
-
-    # Store both the positive and negative vectors
-    key_vectors[key] = {
-        "positive": pos_vector,
-        "negative": neg_vector,
-    }
-
-    mask_phrases = SENSITIVITY_MASKS.get(key)
-    if mask_phrases:
-        mask_embeds = model.encode(mask_phrases, convert_to_tensor = True)
-        mask_vectors[key] = mask_embeds
+# MODEL_ENCODER_BACKEND picks torch, onnx or onnx-int8; see encoders.py and
+# bench/encoder_drift_report.py for the accuracy trade-off.
+MODEL_NAME = "all-mpnet-base-v2"
+ENCODER_BACKEND = os.getenv("MODEL_ENCODER_BACKEND", "torch")
+ENCODER_ID = encoder_id(MODEL_NAME, ENCODER_BACKEND)
+model = load_encoder(MODEL_NAME, ENCODER_BACKEND)
+
+# Sentence segmentation only needs sentence boundaries; see segmentation.py
+# for the available modes and bench/bench_segmentation.py for their trade-offs.
+SEGMENTER_MODE = os.getenv("MODEL_SEGMENTER", "parser")
+split_sentences = load_segmenter(SEGMENTER_MODE)
+
+REFERENCE_MATRIX = load_or_build_reference_matrix(ENCODER_ID, lambda texts: model.encode(texts, convert_to_numpy=True))
+scorer = TraitScorer(REFERENCE_MATRIX)
+
+# --- Sentence embedding cache ---
+# Repeated sentences ("I agree", slogans, reposts) are served from an LRU cache
+# bounded by MODEL_EMBEDDING_CACHE_MB, optionally shared across replicas via Redis.
+EMBEDDING_CACHE_MB = float(os.getenv("MODEL_EMBEDDING_CACHE_MB", 64))
+EMBEDDING_CACHE_REDIS_URL = os.getenv("MODEL_EMBEDDING_CACHE_REDIS_URL")
+EMBEDDING_CACHE_REDIS_TTL = int(os.getenv("MODEL_EMBEDDING_CACHE_REDIS_TTL", 7 * 24 * 3600))
+
+embedding_cache = EmbeddingCache(
+    ENCODER_ID,
+    max_bytes=int(EMBEDDING_CACHE_MB * 1024 * 1024),
+    redis_url=EMBEDDING_CACHE_REDIS_URL,
+    redis_ttl_seconds=EMBEDDING_CACHE_REDIS_TTL,
+)
+
+def encode_sentences(sentences: List[str]) -> np.ndarray:
+    """
+    Encodes sentences, reusing cached embeddings where possible. Only distinct
+    uncached sentences reach the model, in a single batched call.
+    """
+    normalized = [normalize_sentence(sent) for sent in sentences]
+    if not embedding_cache.enabled:
+        return model.encode(normalized, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+
+    keys = [sentence_key(ENCODER_ID, sent) for sent in normalized]
+    found = embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+    missing = {}
+    for key, sent in zip(keys, normalized):
+        if key not in found:
+            missing.setdefault(key, sent)
+    if missing:
+        encoded = model.encode(list(missing.values()), batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+        fresh = dict(zip(missing.keys(), encoded.astype(np.float32)))
+        embedding_cache.put_many(fresh)
+        found.update(fresh)
+
+    return np.vstack([found[key] for key in keys])
+
+class ScoreJob(NamedTuple):
+    text: str
+    debug: bool = False
+
+class ScoreResult(NamedTuple):
+    scores: np.ndarray  # float32, PERSONALITY_KEYS order
+    debug: Optional[Dict[str, object]] = None
+
+def score_documents(jobs: List[ScoreJob]) -> List[ScoreResult]:
+    """
+    Scores many documents with a single batched encode call.
+    Sentences from every document are encoded together and then scored per
+    document, so the result for each text is identical to scoring it alone.
+    Jobs flagged for debugging, plus a DEBUG_SAMPLE_RATE sample of the rest,
+    also get a per-sentence, per-key breakdown.
+    """
+    started = time.perf_counter()
+    doc_sentences = [split_sentences(job.text) if job.text else [] for job in jobs]
+    all_sentences = [sent for sentences in doc_sentences for sent in sentences]
+
+    if all_sentences:
+        embeddings = encode_sentences(all_sentences)
+    else:
+        embeddings = np.zeros((0, scorer.dim), dtype=np.float32)
+
+    scores = scorer.score_documents(doc_sentences, embeddings)
+
+    results = []
+    offset = 0
+    for job, sentences, doc_scores in zip(jobs, doc_sentences, scores):
+        doc_embeddings = embeddings[offset:offset + len(sentences)]
+        offset += len(sentences)
+        sampled = DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+        breakdown = None
+        if (job.debug or sampled) and sentences:
+            breakdown = scorer.explain(sentences, doc_embeddings)
+            if sampled:
+                logger.info("score breakdown %s", json.dumps({"breakdown": breakdown, "scores": dict(zip(PERSONALITY_KEYS, doc_scores.tolist()))}))
+        results.append(ScoreResult(doc_scores, breakdown if job.debug else None))
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("scored %d documents (%d sentences) in %.1f ms",
+                     len(jobs), len(all_sentences), (time.perf_counter() - started) * 1000)
+    return results
+
+# --- Dynamic batching ---
+# Concurrent /score and /score/batch requests are merged into shared encode
+# batches of up to BATCH_MAX_SIZE documents, waiting at most BATCH_MAX_WAIT_MS
+# for a batch to fill.
+BATCH_MAX_SIZE = int(os.getenv("MODEL_BATCH_MAX_SIZE", 32))
+BATCH_MAX_WAIT_MS = float(os.getenv("MODEL_BATCH_MAX_WAIT_MS", 5))
+ENCODE_BATCH_SIZE = int(os.getenv("MODEL_ENCODE_BATCH_SIZE", 64))
+MAX_TEXTS_PER_REQUEST = int(os.getenv("MODEL_MAX_TEXTS_PER_REQUEST", 256))
+
+# --- Inference executor ---
+# spaCy parsing and encoding run on a bounded thread pool, never on the event
+# loop. At most INFERENCE_QUEUE_DEPTH documents may wait for a worker; beyond
+# that requests are rejected with 503 so callers can back off and retry.
+INFERENCE_WORKERS = int(os.getenv("MODEL_INFERENCE_WORKERS", 1))
+INFERENCE_QUEUE_DEPTH = int(os.getenv("MODEL_INFERENCE_QUEUE_DEPTH", 256))
+RETRY_AFTER_SECONDS = os.getenv("MODEL_RETRY_AFTER_SECONDS", "1")
+
+batcher = MicroBatcher(
+    score_documents,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    workers=INFERENCE_WORKERS,
+    max_queue_depth=INFERENCE_QUEUE_DEPTH,
+)
+
+def saturated_exception(e: BatcherSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Model service is saturated: {e}",
+        headers={"Retry-After": RETRY_AFTER_SECONDS},
+    )
 
 # --- API setup ---
 app = FastAPI()
 
 class ScoreRequest(BaseModel):
     text: str
-
-@app.post("/score")
-async def score_text(request: ScoreRequest):
+    debug: bool = Field(False, description="Include the per-sentence, per-key score breakdown in the response.")
+
+class BatchScoreRequest(BaseModel):
+    texts: List[str]
+    debug: bool = Field(False, description="Include the per-sentence, per-key score breakdown for every text.")
+
+class ScoreResponse(BaseModel):
+    keys_version: str = Field(..., description="PERSONALITY_KEYS_VERSION the scores are ordered by.")
+    scores: List[float] = Field(..., description="One score per personality key, in PERSONALITY_KEYS order.")
+    debug: Optional[Dict[str, Any]] = None
+
+class BatchScoreItem(BaseModel):
+    scores: List[float]
+    debug: Optional[Dict[str, Any]] = None
+
+class BatchScoreResponse(BaseModel):
+    keys_version: str
+    results: List[BatchScoreItem]
+
+# Compact alternative to JSON, negotiated with `Accept: application/x-float32`:
+# the body is the (documents x keys) score matrix as little-endian float32,
+# 4 bytes per score, with the shape and key version in response headers.
+# Debug breakdowns are only available as JSON.
+FLOAT32_MEDIA_TYPE = "application/x-float32"
+
+def wants_float32(accept: Optional[str], debug: bool) -> bool:
+    return not debug and accept is not None and FLOAT32_MEDIA_TYPE in accept
+
+def float32_response(matrix: np.ndarray) -> Response:
+    matrix = np.atleast_2d(matrix)
+    return Response(
+        content=np.ascontiguousarray(matrix, dtype="<f4").tobytes(),
+        media_type=FLOAT32_MEDIA_TYPE,
+        headers={
+            "X-Personality-Keys-Version": PERSONALITY_KEYS_VERSION,
+            "X-Score-Shape": f"{matrix.shape[0]},{matrix.shape[1]}",
+        },
+    )
+
+@app.on_event("startup")
+async def on_startup():
+    batcher.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await batcher.stop()
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "queued": batcher.pending, "inflight": batcher.inflight, "queue_depth": batcher.max_queue_depth}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return embedding_cache.stats()
+
+@app.post("/score", response_model=ScoreResponse, response_model_exclude_none=True)
+async def score_text(request: ScoreRequest, accept: Optional[str] = Header(None)):
     text = request.text
     if not text:
         raise HTTPException(status_code=400, detail="No text provided")
 
-    #print(f"[Scoring] Text: {text[:60]}...")
-
-    sentences = re.findall('\w+', text) #split_sentences(text)
-    doc = nlp(text)
-    sentences = [sent.text.strip() for sent in doc.sents]
-
-    if not sentences:
-        return json.dumps({"scores": {k: 0.0 for k in PERSONALITY_KEYS}})
-
-    aggregated_scores = {key: 0.0 for key in PERSONALITY_KEYS}
-    total_weights = {key: 0.0 for key in PERSONALITY_KEYS}
-
-    for sent in sentences:
-        sent_embedding = model.encode(sent, convert_to_tensor=True)
-        sent_len = len(sent.split())
-
-        print(f"\n[Sentence] \"{sent}\" (len={sent_len} words)")
-
-        for key in PERSONALITY_KEYS:
-            # --- Relevance check ---
-            if key in mask_vectors:
-                sims = util.cos_sim(sent_embedding, mask_vectors[key]).cpu().numpy().flatten()
-                relevance = float(max(sims))
-            else:
-                relevance = 1.0
-
-            if relevance < RELEVANCE_HARD_CUTOFF:
-                print(f"  {key}: relevance={relevance:.3f} (below hard cutoff, skipped)")
-                continue
-            elif relevance < RELEVANCE_SOFT_START:
-                weight = (relevance - RELEVANCE_HARD_CUTOFF) / (RELEVANCE_SOFT_START - RELEVANCE_HARD_CUTOFF)
-            else:
-                weight = 1.0
-
-            # Cosine similarity
-            pos_vector = key_vectors[key]["positive"]
-            neg_vector = key_vectors[key]["negative"]
-            pos_similarity = util.cos_sim(sent_embedding, pos_vector).item()
-            neg_similarity = util.cos_sim(sent_embedding, neg_vector).item()
-            raw_score = pos_similarity - neg_similarity
-
-            sensitivity = SENSITIVITY_FACTORS.get(key, 1.0)
-            adjusted_score = raw_score * weight * sensitivity
-
-            # Log debug info
-            print(f"  {key}: relevance={relevance:.3f}, weight={weight:.3f}, "
-                  f"pos_sim={pos_similarity:.3f}, neg_sim={neg_similarity:.3f}, "
-                  f"raw={raw_score:.3f}, sensitivity={sensitivity}, "
-                  f"adj={adjusted_score:.3f}")
-
-            # Aggregate
-            aggregated_scores[key] += adjusted_score * sent_len
-            total_weights[key] += sent_len
-
-    # Finalize averages
-    final_scores = {}
-    for key in PERSONALITY_KEYS:
-        if total_weights[key] > 0:
-            final_scores[key] = aggregated_scores[key] / total_weights[key]
-        else:
-            final_scores[key] = 0.0
-
-    # Softmax normalization
-    score_values = np.array(list(final_scores.values()))
-    exp_scores = np.exp(score_values - np.max(score_values))
-    softmax_scores = SCALE_FACTOR * exp_scores / exp_scores.sum()
-    final_scores = dict(zip(final_scores.keys(), softmax_scores.tolist()))
-
-    return json.dumps({"scores": final_scores})
+    try:
+        result = await batcher.submit(ScoreJob(text, request.debug))
+    except BatcherSaturated as e:
+        raise saturated_exception(e)
+
+    if wants_float32(accept, request.debug):
+        return float32_response(result.scores)
+    return ScoreResponse(keys_version=PERSONALITY_KEYS_VERSION, scores=result.scores.tolist(), debug=result.debug)
+
+@app.post("/score/batch", response_model=BatchScoreResponse, response_model_exclude_none=True)
+async def score_texts(request: BatchScoreRequest, accept: Optional[str] = Header(None)):
+    if not request.texts:
+        raise HTTPException(status_code=400, detail="No texts provided")
+    if len(request.texts) > MAX_TEXTS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_TEXTS_PER_REQUEST} texts per request")
+
+    try:
+        results = await batcher.submit_many([ScoreJob(text, request.debug) for text in request.texts])
+    except BatcherSaturated as e:
+        raise saturated_exception(e)
+
+    if wants_float32(accept, request.debug):
+        return float32_response(np.vstack([result.scores for result in results]))
+    return BatchScoreResponse(
+        keys_version=PERSONALITY_KEYS_VERSION,
+        results=[BatchScoreItem(scores=result.scores.tolist(), debug=result.debug) for result in results],
+    )
 
 # --- Averaging function for backend ---
 def update_running_average(current_avg: float, count: int, new_score: float) -> float:
     return round(((current_avg * count) + new_score) / (count + 1), 4)
 
+# --- Serving ---
+# MODEL_WORKERS=1 runs a single uvicorn process. With more workers the model is
+# loaded once in this process and gunicorn forks the workers from it, so they
+# share the weights copy-on-write instead of holding one copy each.
+MODEL_HOST = os.getenv("MODEL_HOST", "0.0.0.0")
+MODEL_PORT = int(os.getenv("MODEL_PORT", 8001))
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", 1))
+
 def main():
-    uvicorn.run(app, host='0.0.0.0', port=8001) # debug=True for local dev
+    if MODEL_WORKERS <= 1:
+        uvicorn.run(app, host=MODEL_HOST, port=MODEL_PORT) # debug=True for local dev
+        return
+
+    from prefork import PreforkServer, default_threads_per_worker
+    threads = int(os.getenv("MODEL_TORCH_THREADS_PER_WORKER", default_threads_per_worker(MODEL_WORKERS)))
+    logger.info("Starting %d preforked workers with %d torch threads each", MODEL_WORKERS, threads)
+    PreforkServer(app, MODEL_HOST, MODEL_PORT, MODEL_WORKERS, threads).run()
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,5 @@
 # silhouet_config.py
+import hashlib
 
 # Define your comprehensive list of personality keys.
 # This list must be identical and ordered consistently across all services
@@ -67,6 +68,10 @@ PERSONALITY_KEYS = [
     "personal_financial_satisfaction"
 ]
 
+# Short fingerprint of the key order. Services that exchange scores as plain
+# arrays (model -> worker -> database) compare it to detect a config mismatch.
+PERSONALITY_KEYS_VERSION = hashlib.sha256("\n".join(PERSONALITY_KEYS).encode("utf-8")).hexdigest()[:12]
+
 # Aggregation frequencies in hours (can be loaded from environment variables)
 AGGREGATION_FREQUENCIES = {
     "pincode": 1,